@@ -1,8 +1,12 @@
+import html
 import json
-import math
 import os
-from datetime import date, datetime
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
@@ -20,1970 +24,2106 @@ st.set_page_config(page_title="Tracker d'Investissements", page_icon="📈", lay
 # Configuration Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+@st.cache_resource(show_spinner=False)
+def get_supabase() -> Client:
+    """Client Supabase partagé entre toutes les sessions et tous les reruns"""
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+@st.cache_resource(show_spinner=False)
+def get_price_service() -> PriceService:
+    """Service de prix partagé : son cache de cours profite à toutes les sessions"""
+    return PriceService(get_supabase())
+
+
+supabase = get_supabase()
 
 DATA_FILE = "investments_data.json"
+# Sauvegarde locale optionnelle : Supabase reste la source de vérité
+LOCAL_BACKUP = os.getenv("LOCAL_BACKUP")
+TABLES = ("revenus", "bourse", "crypto")
+INVESTMENT_COLUMNS = [
+    "id",
+    "date",
+    "symbole",
+    "quantite",
+    "prix_unitaire",
+    "montant",
+    "hors_budget",
+    "type_operation",
+]
+TABLE_COLUMNS = {
+    "revenus": [
+        "id",
+        "mois",
+        "annee",
+        "periode",
+        "montant",
+        "investissement_disponible_bourse",
+        "investissement_disponible_crypto",
+    ],
+    "bourse": INVESTMENT_COLUMNS,
+    "crypto": INVESTMENT_COLUMNS,
+}
+
+# Ordre des lignes, appliqué par Postgres à la lecture (index dédiés, voir migrations/).
+# id départage les opérations d'une même date : l'ordre est stable d'une lecture à l'autre
+TABLE_ORDER = {
+    "revenus": ("annee", "mois"),
+    "bourse": ("date", "id"),
+    "crypto": ("date", "id"),
+}
+
+# Types des colonnes, déclarés une fois pour toutes plutôt qu'inférés ligne par ligne.
+# Symboles et types d'opération, très répétitifs, sont stockés en catégories ;
+# hors_budget absent (None) sur les anciennes lignes devient False : compté dans le budget
+INVESTMENT_DTYPES = {
+    "symbole": "category",
+    "type_operation": "category",
+    "quantite": "float64",
+    "prix_unitaire": "float64",
+    "montant": "float64",
+    "hors_budget": "bool",
+}
+TABLE_DTYPES = {
+    "revenus": {
+        "mois": "int64",
+        "annee": "int64",
+        "montant": "float64",
+        "investissement_disponible_bourse": "float64",
+        "investissement_disponible_crypto": "float64",
+    },
+    "bourse": INVESTMENT_DTYPES,
+    "crypto": INVESTMENT_DTYPES,
+}
+
+# Colonnes des investissements enrichis par PriceService.calculate_investment_performance
+PERFORMANCE_COLUMNS = INVESTMENT_COLUMNS + [
+    "prix_actuel",
+    "valeur_actuelle",
+    "pnl_montant",
+    "pnl_pourcentage",
+]
+
+# Noms des mois, indexés par numéro de mois - 1
+MOIS_NOMS = (
+    "Janvier",
+    "Février",
+    "Mars",
+    "Avril",
+    "Mai",
+    "Juin",
+    "Juillet",
+    "Août",
+    "Septembre",
+    "Octobre",
+    "Novembre",
+    "Décembre",
+)
+MOIS_OPTIONS = tuple(range(1, len(MOIS_NOMS) + 1))
+
+# Couleur et forme des points du graphique de prix, par type d'opération
+OPERATION_COLORS = {
+    "Achat": "#22C55E",
+    "RoundUP": "#22C55E",
+    "SaveBack": "#22C55E",
+    "Vente": "#EF4444",
+}
+OPERATION_SHAPES = {
+    "Achat": "circle",
+    "RoundUP": "diamond",
+    "SaveBack": "square",
+    "Vente": "triangle-down",
+}
+
+# Libellés affichés des colonnes des tableaux d'investissements
+DISPLAY_COLUMN_NAMES = {
+    "date": "Date",
+    "symbole": "Symbole",
+    "type_operation": "Type",
+    "quantite": "Quantité",
+    "prix_unitaire": "Prix Achat",
+    "montant": "Investi",
+    "prix_actuel": "Prix Actuel",
+    "valeur_actuelle": "Valeur Actuelle",
+    "pnl_montant": "P&L €",
+    "pnl_pourcentage": "P&L %",
+}
+
+# Les dates restent en datetime64 (tri chronologique dans st.dataframe) : seul le rendu
+# les formate, par column_config ou par Styler.format pour les tableaux stylés
+DATE_COLUMN_CONFIG = {"Date": st.column_config.DateColumn(format="DD/MM/YYYY")}
+DATE_FORMAT = "{:%d/%m/%Y}"
+
+
+def _fetch_table(table):
+    """
+    Récupère toutes les lignes d'une table Supabase, limitées aux colonnes utilisées et déjà
+    triées (voir TABLE_ORDER)
+    """
+    requete = supabase.table(table).select(",".join(TABLE_COLUMNS[table]))
+    for colonne in TABLE_ORDER[table]:
+        requete = requete.order(colonne)
+    return requete.execute().data
+
+
+@st.cache_resource(show_spinner=False)
+def _version_donnees():
+    """
+    Version des données partagée par toutes les sessions : st.cache_data est commun à
+    toutes les sessions, sa clé doit donc l'être aussi (un compteur par session ferait
+    relire à une session l'instantané mis en cache par une autre)
+    """
+    return {"lock": threading.Lock(), "valeur": 0}
+
+
+def data_version():
+    """Version courante des données, clé des caches dérivés des tables Supabase"""
+    return _version_donnees()["valeur"]
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_data_cached(nonce):
+    """
+    Charge les trois tables depuis Supabase, mis en cache entre les reruns
+
+    Args:
+        nonce: Version des données (voir data_version), incrémentée après chaque
+            insertion, quelle que soit la session, ce qui invalide le cache
+    """
+    # Les trois requêtes sont lancées en parallèle pour ne payer
+    # qu'un aller-retour réseau au lieu de trois. Les lignes arrivent triées
+    # (TABLE_ORDER) : les tris FIFO et d'affichage en aval portent sur des listes ordonnées
+    with ThreadPoolExecutor(max_workers=len(TABLES)) as executor:
+        return dict(zip(TABLES, executor.map(_fetch_table, TABLES)))
+
+
+def invalidate_data():
+    """Force le rechargement des données depuis Supabase, pour toutes les sessions"""
+    version = _version_donnees()
+    with version["lock"]:
+        version["valeur"] += 1
 
 
 def load_data():
     try:
-        # Charger depuis Supabase
-        revenus = supabase.table("revenus").select("*").execute().data
-        bourse = supabase.table("bourse").select("*").execute().data
-        crypto = supabase.table("crypto").select("*").execute().data
-
-        return {"revenus": revenus, "bourse": bourse, "crypto": crypto}
+        return _load_data_cached(data_version())
     except Exception as e:
         st.error(f"Erreur lors du chargement des données: {e}")
         return {"revenus": [], "bourse": [], "crypto": []}
 
 
-def get_existing_symbols(data, asset_type):
-    """Récupère les symboles uniques existants pour un type d'actif"""
-    if asset_type == "bourse":
-        symbols = [inv["symbole"] for inv in data["bourse"]]
-    elif asset_type == "crypto":
-        symbols = [inv["symbole"] for inv in data["crypto"]]
-    else:
-        symbols = []
+def build_frames(data):
+    """
+    Convertit chaque table en DataFrame, avec des colonnes et des types garantis même si
+    elle est vide
+    """
+    return {
+        table: pd.DataFrame.from_records(data[table], columns=TABLE_COLUMNS[table]).astype(
+            TABLE_DTYPES[table]
+        )
+        for table in TABLES
+    }
 
-    return sorted(list(set(symbols)))
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _load_frames_cached(nonce):
+    """
+    Construit les DataFrames des trois tables, mis en cache avec les données brutes
 
-def save_data(data):
-    # Sauvegarder aussi en local pour backup (optionnel)
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    Args:
+        nonce: Même version que pour _load_data_cached
+    """
+    return build_frames(_load_data_cached(nonce))
 
 
-def main():
-    st.title("Tracker d'Investissements")
-    st.markdown("---")
+def load_frames():
+    """Retourne les tables sous forme de DataFrames (colonnes contiguës pour les calculs)"""
+    try:
+        return _load_frames_cached(data_version())
+    except Exception:
+        # L'erreur est déjà affichée par load_data
+        return build_frames({table: [] for table in TABLES})
+
+
+def build_performance_frame(rows):
+    """
+    Construit le DataFrame d'investissements (avec ou sans performances) aux colonnes fixes :
+    pas d'inférence des colonnes ligne par ligne, et les colonnes de performance existent
+    toujours (vides pour des lignes brutes)
+
+    Args:
+        rows: Investissements, enrichis ou non par calculate_investment_performance
+
+    Returns:
+        DataFrame aux colonnes PERFORMANCE_COLUMNS
+    """
+    return pd.DataFrame.from_records(rows, columns=PERFORMANCE_COLUMNS)
+
+
+def build_symbol_stats(df, symbole):
+    """
+    Agrège montant et quantité d'un symbole, séparément pour les achats et les ventes.
+    Seules les lignes du symbole sont groupées (masque), pas toute la table
+
+    Args:
+        df: DataFrame d'une table d'investissements
+        symbole: Symbole sélectionné
+
+    Returns:
+        Series indexée par (montant|quantite|nombre, est_vente), à zéro si le symbole n'a
+        aucune ligne dans la table
+    """
+    lignes = df[df["symbole"] == symbole]
+    est_vente = lignes["type_operation"].eq("Vente").rename("est_vente")
+    # observed=True : symbole est une catégorie, les symboles absents ne donnent pas de ligne
+    stats = (
+        lignes.groupby(["symbole", est_vente], observed=True)
+        .agg(montant=("montant", "sum"), quantite=("quantite", "sum"), nombre=("montant", "size"))
+        .unstack("est_vente", fill_value=0)
+    )
+    # Garantir les colonnes achats/ventes même si l'une des deux est absente
+    colonnes = pd.MultiIndex.from_product([["montant", "quantite", "nombre"], [False, True]])
+    stats = stats.reindex(columns=colonnes, fill_value=0)
+    return stats.reindex([symbole]).fillna(0).iloc[0]
 
-    data = load_data()
 
-    # Initialiser le service de prix
-    if "price_service" not in st.session_state:
-        st.session_state.price_service = PriceService(supabase)
+# Séparateur de milliers affiché : espace au lieu de la virgule de format()
+_SEPARATEUR_MILLIERS = str.maketrans(",", " ")
 
-    # Sidebar pour saisie des revenus
-    with st.sidebar:
-        st.header("Saisie des Revenus")
-
-        revenu_net = st.number_input(
-            "Revenu net mensuel (€)",
-            min_value=0,
-            value=0,
-            step=100,
-            help="Saisissez votre revenu net mensuel",
-        )
 
-        col_mois, col_annee = st.columns(2)
-        with col_mois:
-            mois_revenu = st.selectbox(
-                "Mois",
-                options=list(range(1, 13)),
-                format_func=lambda x: [
-                    "Janvier",
-                    "Février",
-                    "Mars",
-                    "Avril",
-                    "Mai",
-                    "Juin",
-                    "Juillet",
-                    "Août",
-                    "Septembre",
-                    "Octobre",
-                    "Novembre",
-                    "Décembre",
-                ][x - 1],
-                index=date.today().month - 1,
-            )
-        with col_annee:
-            annee_revenu = st.number_input(
-                "Année", min_value=2020, max_value=2030, value=date.today().year, step=1
-            )
+def eur(valeur, decimales=2):
+    """Formate un montant en euros, espace comme séparateur de milliers ("1 234.50€")"""
+    return f"{valeur:,.{decimales}f}€".translate(_SEPARATEUR_MILLIERS)
 
-        if st.button("Enregistrer Revenu"):
-            if revenu_net > 0:
-                periode_actuelle = f"{annee_revenu}-{mois_revenu:02d}"
 
-                # Vérifier si le revenu pour cette période existe déjà
-                periode_existante = any(r["periode"] == periode_actuelle for r in data["revenus"])
+def eur_signe(valeur, decimales=2):
+    """Formate un montant signé en euros ("+1 234.50€", "-12.00€")"""
+    return f"{valeur:+,.{decimales}f}€".translate(_SEPARATEUR_MILLIERS)
 
-                if periode_existante:
-                    st.error(f"Un revenu pour {periode_actuelle} existe déjà!")
-                else:
-                    montant_investissement_bourse = round(revenu_net * 0.10, 2)
-                    montant_investissement_crypto = round(revenu_net * 0.10, 2)
-                    # Ajouter à Supabase
-                    try:
-                        supabase.table("revenus").insert(
-                            {
-                                "mois": mois_revenu,
-                                "annee": int(annee_revenu),
-                                "periode": periode_actuelle,
-                                "montant": revenu_net,
-                                "investissement_disponible_bourse": montant_investissement_bourse,
-                                "investissement_disponible_crypto": montant_investissement_crypto,
-                            }
-                        ).execute()
-
-                        # Recharger les données
-                        data = load_data()
-                        save_data(data)
-                    except Exception as e:
-                        st.error(f"Erreur lors de l'ajout du revenu: {e}")
-                        return
-                    st.success(
-                        f"Revenu enregistré! {montant_investissement_bourse:,.2f}€ pour bourse, "
-                        f"{montant_investissement_crypto:,.2f}€ pour crypto".replace(",", " ")
-                    )
-                    st.rerun()
 
-    # Calcul des budgets d'investissement séparés
-    budget_bourse_brut = sum([r["investissement_disponible_bourse"] for r in data["revenus"]])
-    budget_crypto_brut = sum([r["investissement_disponible_crypto"] for r in data["revenus"]])
-    budget_bourse = math.ceil(budget_bourse_brut)
-    budget_crypto = math.ceil(budget_crypto_brut)
-    budget_total = budget_bourse + budget_crypto
+def _fmt_eur(serie):
+    """Formate une colonne de montants en euros (espace comme séparateur de milliers)"""
+    formate = serie.map("{:,.2f}€".format, na_action="ignore").astype("string")
+    return formate.str.replace(",", " ", regex=False).fillna("N/A")
 
-    budget_utilise_bourse = sum(
-        [b["montant"] for b in data["bourse"] if not b.get("hors_budget", False)]
-    )
-    budget_utilise_crypto = sum(
-        [c["montant"] for c in data["crypto"] if not c.get("hors_budget", False)]
-    )
 
-    # Total réellement investi (incluant hors budget)
-    total_investi_bourse = sum([b["montant"] for b in data["bourse"]])
-    total_investi_crypto = sum([c["montant"] for c in data["crypto"]])
+def _fmt_eur_signed(serie):
+    """Formate une colonne de montants signés en euros (+/-)"""
+    formate = serie.map("{:+,.2f}€".format, na_action="ignore").astype("string")
+    return formate.str.replace(",", " ", regex=False).fillna("N/A")
 
-    budget_restant_bourse = budget_bourse - budget_utilise_bourse
-    budget_restant_crypto = budget_crypto - budget_utilise_crypto
 
-    # Métriques globales avec performances en temps réel
-    total_investi_reel = total_investi_bourse + total_investi_crypto
-    total_restant = budget_restant_bourse + budget_restant_crypto
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_price_figure(symbole, df_graphique, prix_actuel, prix_moyen_achat):
+    """
+    Construit le graphique des prix d'achat/vente d'un titre, mis en cache par
+    symbole et contenu : revenir sur un titre déjà affiché ne reconstruit pas les traces
 
-    # Calculer les performances globales au chargement si nécessaire
-    portfolio_summary = st.session_state.get("portfolio_summary")
+    Args:
+        symbole: Symbole du titre
+        df_graphique: Colonnes date (datetime), type_operation, prix_unitaire, montant
+        prix_actuel: Prix actuel du titre
+        prix_moyen_achat: Prix moyen d'achat (ligne masquée si 0)
 
-    # Ne calculer que si on n'a pas de résumé ET qu'on n'est pas en train de
-    # gérer des choix de symboles
-    should_calculate_performance = (
-        not portfolio_summary
-        and (data["bourse"] or data["crypto"])
-        and not hasattr(st.session_state, "symbol_choices")
-        and not hasattr(st.session_state, "pending_symbol")
-    )
+    Returns:
+        Figure plotly
+    """
+    fig = go.Figure()
 
-    if should_calculate_performance:
-        # Calculer sans spinner pour éviter les rerun intempestifs
-        crypto_with_perf = (
-            st.session_state.price_service.calculate_investment_performance(
-                data["crypto"], "crypto"
-            )
-            if data["crypto"]
-            else []
-        )
+    # Ligne horizontale pour le prix actuel
+    fig.add_hline(
+        y=prix_actuel,
+        line_dash="dash",
+        line_color="blue",
+        annotation_text=f"Prix actuel: {eur(prix_actuel)}",
+        annotation_position="bottom right",
+    )
 
-        bourse_with_perf = (
-            st.session_state.price_service.calculate_investment_performance(
-                data["bourse"], "bourse"
+    # Un seul groupby, dans l'ordre d'apparition des types (légende stable)
+    for type_op, groupe in df_graphique.groupby("type_operation", sort=False):
+        dates_type = groupe["date"]
+        prix_type = groupe["prix_unitaire"]
+        montants_type = groupe["montant"]
+
+        color = OPERATION_COLORS.get(type_op, "gray")
+        shape = OPERATION_SHAPES.get(type_op, "circle")
+
+        # Préparer les hover texts - TEMPORAIREMENT COMMENTÉ
+        # hover_texts = []
+        # for date, prix, montant
+        # in zip(dates_type, prix_type, montants_type):
+        #     base_text = f"Date:
+        #     {date.strftime('%d/%m/%Y')}<br>Type: {type_op}<br>Prix: {prix:
+        #     ,.2f}€<br>Montant: {montant:,.2f}€".replace(",", " ")
+        #
+        #     if type_op == "Vente":
+        #         # Pour les ventes, ajouter le PnL réalisé
+        #         pnl_realise_data =
+        #         price_service.calculate_realized_pnl(
+        #             data["bourse"], symbole
+        #         )
+        #         base_text += f"<br>PnL réalisé:
+        #         {pnl_realise_data['pnl_realise_montant']
+        #         :+,.2f}€".replace(",", " ")
+        #
+        #     hover_texts.append(base_text)
+
+        # Version simplifiée temporaire (construite colonne par colonne)
+        hover_texts = (
+            "Date: "
+            + dates_type.dt.strftime("%d/%m/%Y")
+            + f"<br>Type: {type_op}<br>Prix: "
+            + _fmt_eur(prix_type)
+            + "<br>Montant: "
+            + _fmt_eur(montants_type)
+        ).tolist()
+
+        fig.add_trace(
+            go.Scatter(
+                x=dates_type,
+                y=prix_type,
+                mode="markers",
+                marker=dict(
+                    size=7.5,
+                    color=color,
+                    symbol=shape,
+                    line=dict(width=2, color=color),
+                ),
+                name=type_op,
+                text=hover_texts,
+                hovertemplate="%{text}<extra></extra>",
             )
-            if data["bourse"]
-            else []
         )
 
-        portfolio_summary = st.session_state.price_service.calculate_portfolio_summary(
-            crypto_with_perf, bourse_with_perf
+    # Ligne du prix moyen d'achat (uniquement si on a des achats)
+    if prix_moyen_achat > 0:
+        fig.add_hline(
+            y=prix_moyen_achat,
+            line_dash="dot",
+            line_color="green",
+            annotation_text=f"Prix moyen d'achat: {eur(prix_moyen_achat)}",
+            annotation_position="top right",
         )
 
-        # Mettre en cache dans la session
-        st.session_state.portfolio_summary = portfolio_summary
-
-        # Mettre aussi en cache les données individuelles pour les onglets
-        if bourse_with_perf:
-            bourse_cache_key = f"bourse_perf_{len(data['bourse'])}"
-            st.session_state[bourse_cache_key] = bourse_with_perf
-        if crypto_with_perf:
-            crypto_cache_key = f"crypto_perf_{len(data['crypto'])}"
-            st.session_state[crypto_cache_key] = crypto_with_perf
-
-    # Bouton pour actualiser les prix - affiché seulement après le calcul
-    # des performances OU s'il n'y a pas d'investissements
-    if portfolio_summary or not (data["bourse"] or data["crypto"]):
-        col_refresh, col_empty = st.columns([1, 5])
-        with col_refresh:
-            if st.button("🔄 Actualiser les prix"):
-                st.session_state.price_service.clear_cache()
-                # Vider aussi le cache des performances
-                if "portfolio_summary" in st.session_state:
-                    del st.session_state.portfolio_summary
-                if "bourse_data_processed" in st.session_state:
-                    del st.session_state.bourse_data_processed
-                if "crypto_data_processed" in st.session_state:
-                    del st.session_state.crypto_data_processed
-                # Vider les caches des onglets individuels
-                for key in list(st.session_state.keys()):
-                    if key.startswith("bourse_perf_") or key.startswith("crypto_perf_"):
-                        del st.session_state[key]
-                st.rerun()
-
-    # Tabs pour Bourse et Crypto
-    tab_revenus, tab_bourse, tab_crypto, tab_overview = st.tabs(
-        ["Revenus", "Bourse", "Crypto", "Vue d'ensemble"]
+    fig.update_layout(
+        title=f"Évolution des prix d'achat - {symbole}",
+        xaxis_title="Date",
+        yaxis_title="Prix (€)",
+        hovermode="closest",
+        showlegend=True,
+        height=400,
     )
 
-    with tab_bourse:
-        st.header("Investissements Bourse")
-
-        # Métriques spécifiques bourse
-        col_m1, col_m2, col_m3, col_m4, col_m5 = st.columns(5)
-        with col_m1:
-            st.metric("Budget Bourse", f"{budget_bourse:,}€".replace(",", " "))
-        with col_m2:
-            st.metric("Investi Bourse", f"{total_investi_bourse:,.2f}€".replace(",", " "))
-        with col_m3:
-            st.metric("Restant Bourse", f"{budget_restant_bourse:,.2f}€".replace(",", " "))
-        with col_m4:
-            # Calculer la valeur actuelle à partir des données individuelles si disponibles
-            bourse_cache_key = f"bourse_perf_{len(data['bourse'])}"
-            bourse_with_perf = st.session_state.get(bourse_cache_key)
+    return fig
 
-            if bourse_with_perf and any(inv.get("valeur_actuelle") for inv in bourse_with_perf):
-                valeur_actuelle_bourse = sum(
-                    inv.get("valeur_actuelle", inv["montant"]) for inv in bourse_with_perf
-                )
-                st.metric("Valeur Actuelle", f"{valeur_actuelle_bourse:,.2f}€".replace(",", " "))
-            elif portfolio_summary and portfolio_summary["bourse"]["valeur_actuelle"] > 0:
-                valeur_actuelle_bourse = portfolio_summary["bourse"]["valeur_actuelle"]
-                st.metric("Valeur Actuelle", f"{valeur_actuelle_bourse:,.2f}€".replace(",", " "))
-            else:
-                st.metric("Valeur Actuelle", f"{total_investi_bourse:,.2f}€".replace(",", " "))
-        with col_m5:
-            # Calculer le P&L à partir des données individuelles si disponibles
-            if bourse_with_perf and any(
-                inv.get("pnl_montant") is not None for inv in bourse_with_perf
-            ):
-                pnl_bourse = sum(
-                    inv.get("pnl_montant", 0)
-                    for inv in bourse_with_perf
-                    if inv.get("pnl_montant") is not None
-                )
-                pnl_pct_bourse = (
-                    (pnl_bourse / total_investi_bourse * 100) if total_investi_bourse > 0 else 0
-                )
-                st.metric(
-                    "P&L Total",
-                    f"{pnl_bourse:+,.2f}€".replace(",", " "),
-                    delta=f"{pnl_pct_bourse:+.1f}%",
-                )
-            elif portfolio_summary and portfolio_summary["bourse"]["pnl_montant"] is not None:
-                pnl_bourse = portfolio_summary["bourse"]["pnl_montant"]
-                pnl_pct_bourse = portfolio_summary["bourse"]["pnl_pourcentage"]
-                st.metric(
-                    "P&L Total",
-                    f"{pnl_bourse:+,.2f}€".replace(",", " "),
-                    delta=f"{pnl_pct_bourse:+.1f}%",
-                )
-            else:
-                st.metric("P&L Total", "0€", delta="0.0%")
 
-        st.markdown("---")
+def _metrics_row(items):
+    """
+    Affiche une ligne de métriques en un seul bloc HTML (grille CSS) au lieu d'un
+    st.metric par colonne : un seul élément à transmettre et à rendre côté navigateur
 
-        col1, col2 = st.columns([1, 2])
+    Args:
+        items: Liste de tuples (libellé, valeur, delta ou None), un par colonne
+    """
+    cellules = []
+    for libelle, valeur, delta in items:
+        cellule = (
+            f'<div style="font-size:0.875rem;opacity:0.7">{html.escape(libelle)}&nbsp;</div>'
+            f'<div style="font-size:1.75rem">{html.escape(valeur)}&nbsp;</div>'
+        )
+        if delta:
+            negatif = delta.startswith("-")
+            couleur = "#EF4444" if negatif else "#22C55E"
+            fleche = "↓" if negatif else "↑"
+            cellule += (
+                f'<div style="color:{couleur};font-size:0.875rem">'
+                f"{fleche} {html.escape(delta)}</div>"
+            )
+        cellules.append(f"<div>{cellule}</div>")
 
-        with col1:
-            st.subheader("Nouvel investissement")
-
-            # Saisie du symbole avec liste déroulante
-            existing_symbols_bourse = get_existing_symbols(data, "bourse")
-
-            if existing_symbols_bourse:
-                # Utiliser un selectbox avec les symboles existants + option "Autre"
-                options = existing_symbols_bourse + ["🆕 Autre symbole..."]
-                symbole_choice = st.selectbox(
-                    "Symbole",
-                    options=options,
-                    index=None,
-                    placeholder="-- Choisir un symbole --",
-                    help="Choisissez un symbole existant ou 'Autre symbole...' "
-                    "pour saisir manuellement",
-                )
+    st.markdown(
+        f'<div style="display:grid;grid-template-columns:repeat({len(items)}, 1fr);'
+        f'gap:1rem;margin-bottom:1rem">{"".join(cellules)}</div>',
+        unsafe_allow_html=True,
+    )
 
-                if symbole_choice == "🆕 Autre symbole...":
-                    symbole_bourse = st.text_input(
-                        "Nouveau symbole",
-                        placeholder="Ex: NVIDIA, AAPL, HIWS...",
-                        help="Tapez le nom ou symbole de l'action",
-                        label_visibility="collapsed",
-                    )
-                elif symbole_choice is not None:
-                    symbole_bourse = symbole_choice
-                else:
-                    symbole_bourse = ""
-            else:
-                # Si aucun symbole existant, saisie directe
-                symbole_bourse = st.text_input(
-                    "Symbole",
-                    placeholder="Ex: NVIDIA, AAPL, HIWS...",
-                    help="Tapez le nom ou symbole de l'action",
-                )
 
-            hors_budget_bourse = st.checkbox(
-                "Hors budget (conversion/existant)",
-                help="Cochez si c'est un investissement existant "
-                "ou une conversion qui ne doit pas être déduit du budget",
-                key="bourse_hors_budget",
-            )
+def build_positions_table(positions, decimales_quantite=4):
+    """
+    Construit le tableau d'affichage des positions FIFO restantes, colonne par colonne
 
-            # Type d'opération
-            type_operation_bourse = st.selectbox(
-                "Type d'opération",
-                options=["Achat", "Vente", "RoundUP", "SaveBack"],
-                index=0,
-                help="Sélectionnez le type d'opération (achat, vente, roundup, ou saveback)",
-                key="bourse_type_operation",
-            )
+    Args:
+        positions: Positions retournées par calculer_positions_restantes_fifo (liste ou DataFrame)
+        decimales_quantite: Nombre de décimales des quantités (8 pour les cryptos)
 
-            montant_bourse = st.number_input(
-                "Montant (€)",
-                min_value=0.0,
-                value=None,
-                step=10.0,
-                key="bourse_montant",
-                help="Saisissez le montant de votre investissement",
-            )
-            date_bourse = st.date_input("Date d'achat", key="bourse_date")
-            prix_unitaire_bourse = st.number_input(
-                "Prix unitaire (€)", min_value=0.0, value=None, step=0.01, key="bourse_prix"
-            )
+    Returns:
+        DataFrame formaté pour st.dataframe
+    """
+    df = pd.DataFrame(positions)
+    quantite_initiale = df["quantite_initiale"]
+    pourcentage_vendu = (
+        (quantite_initiale - df["quantite_restante"])
+        / quantite_initiale.where(quantite_initiale > 0)
+        * 100
+    )
 
-            # Interface de choix si plusieurs options trouvées
-            if hasattr(st.session_state, "symbol_choices") and st.session_state.symbol_choices:
-                st.subheader(f"Choisir le symbole pour '{st.session_state.pending_symbol}':")
+    def format_montant(serie):
+        return serie.map("{:,.2f}".format).str.replace(",", " ", regex=False)
+
+    format_quantite = f"{{:.{decimales_quantite}f}}".format
+
+    return pd.DataFrame(
+        {
+            "Date": pd.to_datetime(df["date"], format="%Y-%m-%d").dt.strftime("%d/%m/%Y"),
+            "Type": df["type_operation"],
+            "Prix €": format_montant(df["prix_unitaire"]),
+            "Quantité Initiale": quantite_initiale.map(format_quantite),
+            "Quantité Restante": df["quantite_restante"].map(format_quantite),
+            "Valeur Restante €": format_montant(df["montant_restant"]),
+            "% Vendu": pourcentage_vendu.map("{:.1f}%".format).where(quantite_initiale > 0, "0%"),
+        }
+    )
 
-                choices = st.session_state.symbol_choices
-                choice_labels = []
 
-                for i, (variant, price, market, company) in enumerate(choices):
-                    label = f"{variant} ({market}) - {company} - {price:.2f}€"
-                    choice_labels.append(label)
+def style_pnl(col):
+    """
+    Couleur CSS d'une colonne de P&L numérique : vert si positif ou nul (affiché "+"),
+    rouge si négatif, rien si la valeur manque
+    """
+    valeurs = col.to_numpy(dtype=float)
+    return np.select([valeurs >= 0, valeurs < 0], ["color: green", "color: red"], default="")
+
+
+def get_existing_symbols(df):
+    """Récupère les symboles uniques existants (triés) d'une table d'investissements"""
+    return sorted(df["symbole"].dropna().unique())
+
+
+@st.cache_data(show_spinner=False)
+def build_portfolio_display(investments_with_perf):
+    """
+    Construit le tableau d'affichage d'un portfolio (bourse ou crypto), mis en cache
+    entre les reruns
+
+    Args:
+        investments_with_perf: Investissements avec données de performance
+
+    Returns:
+        DataFrame trié du plus récent au plus ancien (dates en datetime64), colonnes renommées
+    """
+    df_portfolio = build_performance_frame(investments_with_perf)
+    df_portfolio["date"] = pd.to_datetime(df_portfolio["date"], format="%Y-%m-%d")
+    df_portfolio = df_portfolio.sort_values("date", ascending=False)  # Plus récent en premier
+
+    # Préparer les colonnes d'affichage
+    colonnes_base = ["date", "symbole", "type_operation", "quantite", "prix_unitaire", "montant"]
+
+    # Ajouter les colonnes de performance si disponibles
+    if df_portfolio["pnl_montant"].notna().any():
+        colonnes_base += ["prix_actuel", "valeur_actuelle", "pnl_montant", "pnl_pourcentage"]
+
+    df_display = df_portfolio[colonnes_base].rename(columns=DISPLAY_COLUMN_NAMES)
+
+    # Allège la sérialisation Arrow : colonnes textuelles répétitives en catégories
+    # (encodage dictionnaire) et pourcentages en float32. Les montants restent en float64,
+    # le float32 perdrait les centimes au-delà du million d'euros
+    dtypes_affichage = {nom: "category" for nom in ("Symbole", "Type") if nom in df_display.columns}
+    if "P&L %" in df_display.columns:
+        dtypes_affichage["P&L %"] = "float32"
+    return df_display.astype(dtypes_affichage)
+
+
+def portfolio_formats(colonnes, format_quantite):
+    """
+    Formats Styler.format du tableau de portfolio : les colonnes restent numériques (tri
+    possible dans st.dataframe), seules les cellules affichées sont formatées
+
+    Args:
+        colonnes: Colonnes du tableau construit par build_portfolio_display
+        format_quantite: Format des quantités (plus de décimales pour les cryptos)
+    """
+
+    formats = {
+        "Date": DATE_FORMAT,
+        "Quantité": format_quantite,
+        "Prix Achat": eur,
+        "Investi": eur,
+    }
+    if "P&L €" in colonnes:
+        formats.update(
+            {
+                "Prix Actuel": eur,
+                "Valeur Actuelle": eur,
+                "P&L €": eur_signe,
+                "P&L %": "{:+.1f}%".format,
+            }
+        )
+    return formats
+
+
+def render_transaction_history(df_perf, format_quantite):
+    """
+    Affiche l'historique des transactions d'un symbole (Deep Dive bourse et crypto), du plus
+    récent au plus ancien. Couleur des P&L portée par un préfixe et dates par column_config :
+    pas de Styler, rendu beaucoup plus léger
+
+    Args:
+        df_perf: Transactions du symbole (dates parsées), avec ou sans performances
+        format_quantite: Format des quantités (plus de décimales pour les cryptos)
+    """
+    # Les lignes chargées sont déjà chronologiques : inverser suffit, sauf après un ajout
+    # incrémental antidaté (la ligne est alors en fin de cache)
+    if df_perf["date"].is_monotonic_increasing:
+        df_symbole = df_perf.iloc[::-1]
+    else:
+        df_symbole = df_perf.sort_values("date", ascending=False)
+
+    colonnes_base = ["date", "type_operation", "quantite", "prix_unitaire", "montant"]
+    df_display = df_symbole[colonnes_base].copy()
+    # Peu de valeurs distinctes : catégorie, encodée en dictionnaire côté Arrow
+    df_display["type_operation"] = df_display["type_operation"].astype("category")
+
+    # Formatage
+    df_display["montant"] = _fmt_eur(df_display["montant"])
+    df_display["prix_unitaire"] = _fmt_eur(df_display["prix_unitaire"])
+    df_display["quantite"] = df_display["quantite"].map(format_quantite)
+
+    # Hauteur fixe (35 px par ligne, en-tête compris, 400 px max) : au-delà, la grille
+    # défile et ne dessine que les lignes visibles
+    hauteur = min(400, 35 * (len(df_display) + 1))
+    column_config = DATE_COLUMN_CONFIG
+
+    # Ajouter les colonnes de performance si disponibles
+    if df_symbole["pnl_montant"].notna().any():
+        df_display["prix_actuel"] = _fmt_eur(df_symbole["prix_actuel"])
+        df_display["valeur_actuelle"] = _fmt_eur(df_symbole["valeur_actuelle"])
+        pnl = df_symbole["pnl_montant"].to_numpy(dtype=float)
+        prefixe = np.select([pnl >= 0, pnl < 0], ["🟢 ", "🔴 "], default="")
+        df_display["pnl_montant"] = prefixe + _fmt_eur_signed(df_symbole["pnl_montant"])
+        df_display["pnl_pourcentage"] = prefixe + df_symbole["pnl_pourcentage"].map(
+            "{:+.1f}%".format, na_action="ignore"
+        ).astype("string").fillna("N/A")
+        column_config = {**DATE_COLUMN_CONFIG, "P&L %": st.column_config.TextColumn(width="small")}
+
+    # Renommer les colonnes (celles absentes sont simplement ignorées)
+    st.dataframe(
+        df_display.rename(columns=DISPLAY_COLUMN_NAMES),
+        use_container_width=True,
+        height=hauteur,
+        column_config=column_config,
+    )
 
-                selected_choice = st.radio(
-                    "Symboles trouvés:",
-                    options=range(len(choices)),
-                    format_func=lambda x: choice_labels[x],
-                    key="symbol_choice_radio",
-                )
 
-                col_choose, col_cancel = st.columns(2)
+@st.cache_data(ttl=60, show_spinner=False)
+def _existing_symbols_cached(nonce):
+    """
+    Symboles existants de chaque table d'investissements, recalculés seulement
+    quand les données changent
+
+    Args:
+        nonce: Même version que pour _load_data_cached
+    """
+    frames = _load_frames_cached(nonce)
+    return {table: get_existing_symbols(frames[table]) for table in ("bourse", "crypto")}
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _positions_fifo_cached(nonce, table, symbole):
+    """
+    Positions FIFO restantes d'un symbole, recalculées seulement quand les données
+    changent (et non à chaque rerun du Deep Dive)
+
+    Args:
+        nonce: Même version que pour _load_data_cached
+        table: Table d'investissements ("bourse" ou "crypto")
+        symbole: Symbole à analyser
+    """
+    return business_logic.calculer_positions_restantes_fifo(
+        _load_data_cached(nonce)[table], symbole
+    )
 
-                with col_choose:
-                    if st.button("✅ Utiliser ce symbole", key="confirm_choice"):
-                        chosen_variant, chosen_price, chosen_market, chosen_company = choices[
-                            selected_choice
-                        ]
 
-                        # Sauvegarder le choix
-                        final_price = st.session_state.price_service.save_user_choice(
-                            st.session_state.pending_symbol, chosen_variant, chosen_company
-                        )
+@st.cache_data(ttl=60, show_spinner=False)
+def _realized_pnl_cached(nonce, table, symbole):
+    """
+    PnL réalisé FIFO d'un symbole, recalculé seulement quand les données changent
+
+    Args:
+        nonce: Même version que pour _load_data_cached
+        table: Table d'investissements ("bourse" ou "crypto")
+        symbole: Symbole à analyser
+    """
+    return get_price_service().calculate_realized_pnl(_load_data_cached(nonce)[table], symbole)
+
+
+@st.cache_resource(show_spinner=False)
+def _etat_sauvegarde():
+    """
+    Verrou des sauvegardes locales et empreinte du dernier contenu écrit, partagés par les
+    threads de toutes les sessions (une globale du script serait recréée à chaque rerun)
+    """
+    return {"lock": threading.Lock(), "empreinte": None}
+
+
+def save_data(data, etat):
+    """
+    Écrit le backup JSON local, seulement si LOCAL_BACKUP est défini
+
+    Args:
+        data: Données chargées (voir load_data)
+        etat: Verrou et dernière empreinte écrite (voir _etat_sauvegarde)
+    """
+    if not LOCAL_BACKUP:
+        return
+    # json.dumps sans indentation passe par l'encodeur C et écrit en un seul appel
+    contenu = json.dumps(data)
+    empreinte = hash(contenu)
+    with etat["lock"]:
+        if empreinte == etat["empreinte"]:
+            # Contenu identique au backup déjà écrit : rien à réécrire
+            return
+        # Fichier temporaire dans le même dossier puis remplacement atomique : une écriture
+        # interrompue ne laisse jamais un backup tronqué. Créé comme open() le ferait
+        # (0o666 moins l'umask), puis avec les droits du backup existant s'il y en a un
+        chemin_tmp = f"{DATA_FILE}.{os.getpid()}.tmp"
+        fd = os.open(chemin_tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            try:
+                if os.path.exists(DATA_FILE):
+                    os.fchmod(fd, stat.S_IMODE(os.stat(DATA_FILE).st_mode))
+                f = os.fdopen(fd, "w")
+            except Exception:
+                os.close(fd)
+                raise
+            with f:
+                f.write(contenu)
+            os.replace(chemin_tmp, DATA_FILE)
+        except Exception:
+            os.unlink(chemin_tmp)
+            raise
+        etat["empreinte"] = empreinte
+
+
+def save_data_in_background(data):
+    """
+    Sauvegarde locale dans un thread d'arrière-plan, une fois par version des données :
+    l'écriture du JSON ne bloque ni l'insertion ni le rerun qui la suit
+    """
+    nonce = data_version()
+    if not LOCAL_BACKUP or st.session_state.get("backup_nonce", 0) == nonce:
+        return
+    st.session_state.backup_nonce = nonce
+    threading.Thread(target=save_data, args=(data, _etat_sauvegarde()), daemon=True).start()
+
+
+def _perf_cache():
+    """Espace de noms des performances en session (un seul dict, vidé d'un coup)"""
+    return st.session_state.setdefault("_perf_cache", {})
+
+
+def get_perf_cache(key):
+    """Retourne les performances en cache pour cette clé, ou None"""
+    return _perf_cache().get(key)
+
+
+def set_perf_cache(key, investments_with_perf):
+    """Met en cache des performances en session"""
+    _perf_cache()[key] = investments_with_perf
+
+
+def clear_perf_cache():
+    """Supprime toutes les performances mises en cache par set_perf_cache"""
+    _perf_cache().clear()
+
+
+def perf_cache_key(asset_type, rows):
+    """
+    Clé de cache des performances, dérivée du contenu des lignes et non de leur nombre :
+    toute modification d'une ligne invalide le cache
+
+    Args:
+        asset_type: Type d'actif ('bourse' ou 'crypto')
+        rows: Lignes de la table d'investissements
+    """
+    empreinte = hash(tuple(tuple(row.get(col) for col in INVESTMENT_COLUMNS) for row in rows))
+    return f"{asset_type}_perf_{empreinte}"
+
+
+def get_portfolio_summary(cache_keys):
+    """
+    Retourne le résumé du portefeuille en session, ou None s'il a été calculé sur d'autres
+    données (insertion, ou rechargement après modification depuis une autre session)
+
+    Args:
+        cache_keys: Clés de performances courantes par type d'actif (voir perf_cache_key)
+    """
+    if st.session_state.get("portfolio_summary_keys") != cache_keys:
+        return None
+    return st.session_state.get("portfolio_summary")
+
+
+def set_portfolio_summary(cache_keys, summary):
+    """Met en cache le résumé du portefeuille en session, avec les clés des données sources"""
+    st.session_state.portfolio_summary = summary
+    st.session_state.portfolio_summary_keys = dict(cache_keys)
+
+
+def compute_portfolio_performances(data, cache_keys):
+    """
+    Calcule le résumé du portefeuille, en réutilisant les performances déjà en cache (calculées
+    par un onglet) ; celles qui manquent sont calculées et mises en cache pour les onglets
+
+    Args:
+        data: Données chargées (voir load_data)
+        cache_keys: Clés de performances courantes par type d'actif (voir perf_cache_key)
+
+    Returns:
+        Résumé du portefeuille (voir PriceService.calculate_portfolio_summary)
+    """
+    price_service = get_price_service()
+    perf_par_type = {}
+    for asset_type in ("crypto", "bourse"):
+        perf = get_perf_cache(cache_keys[asset_type])
+        if perf is None:
+            perf = (
+                price_service.calculate_investment_performance(data[asset_type], asset_type)
+                if data[asset_type]
+                else []
+            )
+            if perf:
+                set_perf_cache(cache_keys[asset_type], perf)
+        perf_par_type[asset_type] = perf
 
-                        if final_price:
-                            st.success(
-                                f"💾 Choix sauvegardé ! {st.session_state.pending_symbol} → "
-                                f"{chosen_variant} ({final_price:.2f}€)"
-                            )
+    portfolio_summary = price_service.calculate_portfolio_summary(
+        perf_par_type["crypto"], perf_par_type["bourse"]
+    )
+    set_portfolio_summary(cache_keys, portfolio_summary)
+    return portfolio_summary
+
+
+def mettre_en_attente(table, donnees):
+    """Empile une opération dans la file d'attente de la table, insérée plus tard en un seul appel
+
+    Args:
+        table: Nom de la table Supabase ("bourse" ou "crypto")
+        donnees: Ligne à insérer
+    """
+    st.session_state.setdefault(f"pending_{table}", []).append(donnees)
+
+
+def add_to_performance_cache(asset_type, ancienne_cle, rows, investissement):
+    """
+    Ajoute un nouvel achat aux performances en session sans tout recalculer
+
+    Args:
+        asset_type: Type d'actif ('bourse' ou 'crypto')
+        ancienne_cle: Clé de cache des performances avant l'insertion
+        rows: Lignes de la table rechargées après l'insertion
+        investissement: Ligne insérée (retournée par Supabase)
+    """
+    perf_en_cache = _perf_cache().pop(ancienne_cle, None)
+    if perf_en_cache is None or len(rows) != len(perf_en_cache) + 1:
+        # Rien en cache, ou la table a changé par ailleurs : calcul complet au prochain rendu
+        return
+
+    price_service = get_price_service()
+    enrichi = price_service.calculate_investment_performance_single(investissement, asset_type)
+    nouvelle_cle = perf_cache_key(asset_type, rows)
+    set_perf_cache(nouvelle_cle, perf_en_cache + [enrichi])
+
+    # Le résumé ne suit l'insertion que s'il portait sur les données d'avant
+    cles_resume = st.session_state.get("portfolio_summary_keys")
+    if cles_resume and cles_resume.get(asset_type) == ancienne_cle:
+        try:
+            price_service.merge_into_summary(
+                st.session_state.portfolio_summary, enrichi, asset_type, rows
+            )
+            cles_resume[asset_type] = nouvelle_cle
+        except ValueError:
+            # Achat antidaté avant une vente : le PnL réalisé change, le résumé est
+            # recalculé au prochain rendu (à partir des performances en cache)
+            st.session_state.pop("portfolio_summary", None)
+            st.session_state.pop("portfolio_summary_keys", None)
+
+
+@st.fragment
+def _render_symbole_panel(data, df_bourse_data, bourse_cache_key, existing_symbols_bourse):
+    """Affiche le Deep Dive bourse (sélection du titre, métriques, graphique, historique)
+
+    Exécuté comme fragment : changer de titre ne relance que ce panneau, pas toute la page.
+
+    Args:
+        data: Données chargées (dict de listes par table)
+        df_bourse_data: DataFrame des investissements bourse
+        bourse_cache_key: Clé du cache de performances bourse (voir get_perf_cache)
+        existing_symbols_bourse: Liste triée des symboles bourse
+    """
+    price_service = get_price_service()
+
+    # Section Deep Dive - en dehors des colonnes pour être centrée
+    if data["bourse"]:
+        st.markdown("---")
 
-                        # Nettoyer les variables de session
-                        del st.session_state.symbol_choices
-                        del st.session_state.pending_symbol
-                        st.rerun()
+        # Section Deep Dive
+        st.subheader("📊 Deep Dive")
 
-                with col_cancel:
-                    if st.button("❌ Annuler", key="cancel_choice"):
-                        del st.session_state.symbol_choices
-                        del st.session_state.pending_symbol
-                        st.rerun()
+        # Récupérer les symboles uniques
+        symboles_uniques = existing_symbols_bourse
 
-            if st.button("Ajouter Investissement Bourse"):
-                if symbole_bourse and (montant_bourse or 0) > 0 and (prix_unitaire_bourse or 0) > 0:
-
-                    if type_operation_bourse == "Vente":
-                        # Validation spécifique pour les ventes
-                        quantite_vente = montant_bourse / prix_unitaire_bourse
-                        erreurs = business_logic.valider_donnees_vente(
-                            montant_bourse,
-                            prix_unitaire_bourse,
-                            symbole_bourse,
-                            quantite_vente,
-                            data["bourse"],
-                        )
+        # Récupérer la sélection précédente si elle existe
+        default_index = None
+        if "bourse_deep_dive_symbol" in st.session_state:
+            previous_symbol = st.session_state.bourse_deep_dive_symbol
+            if previous_symbol in symboles_uniques:
+                default_index = symboles_uniques.index(previous_symbol)
 
-                        if erreurs:
-                            for erreur in erreurs:
-                                st.error(erreur)
-                        else:
-                            # Créer les données de vente
-                            donnees_vente = business_logic.creer_donnees_vente(
-                                date_bourse.isoformat(),
-                                symbole_bourse,
-                                montant_bourse,
-                                prix_unitaire_bourse,
-                            )
+        symbole_selected = st.selectbox(
+            "Sélectionner un titre pour analyse détaillée",
+            options=symboles_uniques,
+            index=default_index,
+            placeholder="-- Choisir un titre --",
+        )
 
-                            try:
-                                supabase.table("bourse").insert(donnees_vente).execute()
-
-                                # Recharger les données
-                                data = load_data()
-                                save_data(data)
-
-                                # Vider tous les caches de performance qui pourraient être corrompus
-                                keys_to_remove = [
-                                    key
-                                    for key in st.session_state.keys()
-                                    if "perf" in key or "cache" in key
-                                ]
-                                for key in keys_to_remove:
-                                    del st.session_state[key]
-
-                                st.success("Vente bourse ajoutée!")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Erreur lors de l'ajout de la vente bourse: {e}")
-                    else:
-                        # Validation standard pour les achats
-                        erreurs = business_logic.valider_donnees_investissement(
-                            montant_bourse, prix_unitaire_bourse, symbole_bourse
-                        )
+        # Sauvegarder la sélection dans session_state
+        if symbole_selected:
+            st.session_state.bourse_deep_dive_symbol = symbole_selected
 
-                        if erreurs:
-                            for erreur in erreurs:
-                                st.error(erreur)
-                        else:
-                            # Créer les données d'investissement standard
-                            donnees_investissement = business_logic.creer_donnees_investissement(
-                                date_bourse.isoformat(),
-                                symbole_bourse,
-                                montant_bourse,
-                                prix_unitaire_bourse,
-                                hors_budget_bourse,
-                            )
-                            # Ajouter le type d'opération
-                            donnees_investissement["type_operation"] = type_operation_bourse
+        if symbole_selected:
+            # Récupérer les données de performance si disponibles
+            bourse_with_perf = get_perf_cache(bourse_cache_key)
 
-                            try:
-                                supabase.table("bourse").insert(donnees_investissement).execute()
+            # Filtrer les investissements pour ce symbole
+            investissements_symbole = [
+                inv for inv in data["bourse"] if inv["symbole"] == symbole_selected
+            ]
 
-                                # Recharger les données
-                                data = load_data()
-                                save_data(data)
-                                st.success("Investissement bourse ajouté!")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Erreur lors de l'ajout de l'investissement bourse: {e}")
+            if bourse_with_perf:
+                perf_symbole = [
+                    inv for inv in bourse_with_perf if inv["symbole"] == symbole_selected
+                ]
+            else:
+                perf_symbole = investissements_symbole
+
+            # Une seule conversion en colonnes pour les métriques et le graphique
+            df_perf = build_performance_frame(perf_symbole)
+            # Dates parsées une seule fois (graphique et historique)
+            df_perf["date"] = pd.to_datetime(df_perf["date"], format="%Y-%m-%d")
+            valeurs_actuelles = df_perf["valeur_actuelle"]
+            prix_actuels = df_perf["prix_actuel"]
+            prix_actuels = prix_actuels[prix_actuels.notna() & prix_actuels.ne(0)]
+            prix_actuel = prix_actuels.iloc[0] if not prix_actuels.empty else None
+
+            # Calculer les statistiques
+            # Totaux achats/ventes du symbole (zéro s'il n'a plus de ligne dans la table)
+            stats_symbole = build_symbol_stats(df_bourse_data, symbole_selected)
+            ventes_symbole = stats_symbole[("nombre", True)] > 0
+
+            # Quantité réelle disponible (achats - ventes), jamais négative
+            quantite_disponible = max(
+                0.0, stats_symbole[("quantite", False)] - stats_symbole[("quantite", True)]
+            )
 
-        with col2:
-            if data["bourse"]:
-                st.subheader("Portfolio Bourse")
+            # Total investi = somme des achats seulement
+            # (les ventes ne comptent pas comme investissement)
+            total_investi_symbole = stats_symbole[("montant", False)]
 
-                # Calculer les performances avec prix actuels seulement si nécessaire
-                bourse_cache_key = f"bourse_perf_{len(data['bourse'])}"
-                if bourse_cache_key not in st.session_state:
-                    with st.spinner("Récupération des prix actuels..."):
-                        bourse_with_perf = (
-                            st.session_state.price_service.calculate_investment_performance(
-                                data["bourse"], "bourse"
-                            )
-                        )
-                        st.session_state[bourse_cache_key] = bourse_with_perf
-                else:
-                    bourse_with_perf = st.session_state[bourse_cache_key]
+            # Prix moyen d'achat basé sur les achats seulement
+            total_quantite_achats = stats_symbole[("quantite", False)]
+            prix_moyen_achat = (
+                total_investi_symbole / total_quantite_achats if total_quantite_achats > 0 else 0
+            )
 
-                if bourse_with_perf:
-                    df_bourse = pd.DataFrame(bourse_with_perf)
-                    # Trier par date AVANT la conversion en format d'affichage
-                    df_bourse["date"] = pd.to_datetime(df_bourse["date"])
-                    df_bourse = df_bourse.sort_values(
-                        "date", ascending=False
-                    )  # Plus récent en premier
-                    df_bourse["date"] = df_bourse["date"].dt.strftime("%d/%m/%Y")
-
-                    # Préparer les colonnes d'affichage
-                    colonnes_base = ["date", "symbole", "quantite", "prix_unitaire", "montant"]
-
-                    # Ajouter type_operation si disponible
-                    if "type_operation" in df_bourse.columns:
-                        colonnes_base.insert(2, "type_operation")
-
-                    df_display = df_bourse[colonnes_base].copy()
-
-                    # Formatage de base d'abord
-                    df_display["montant"] = df_display["montant"].apply(
-                        lambda x: f"{x:,.2f}€".replace(",", " ")
-                    )
-                    df_display["prix_unitaire"] = df_display["prix_unitaire"].apply(
-                        lambda x: f"{x:,.2f}€".replace(",", " ")
-                    )
-                    df_display["quantite"] = df_display["quantite"].apply(lambda x: f"{x:.4f}")
-
-                    # Ajouter les colonnes de performance si disponibles
-                    styled_df = df_display  # Par défaut, pas de style
-                    if (
-                        "prix_actuel" in df_bourse.columns
-                        and "pnl_montant" in df_bourse.columns
-                        and "pnl_pourcentage" in df_bourse.columns
-                    ):
-                        df_display["prix_actuel"] = df_bourse["prix_actuel"].apply(
-                            lambda x: f"{x:,.2f}€".replace(",", " ") if x is not None else "N/A"
-                        )
-                        df_display["valeur_actuelle"] = df_bourse["valeur_actuelle"].apply(
-                            lambda x: f"{x:,.2f}€".replace(",", " ")
-                        )
-                        df_display["pnl_montant"] = df_bourse["pnl_montant"].apply(
-                            lambda x: f"{x:+,.2f}€".replace(",", " ")
-                        )
-                        df_display["pnl_pourcentage"] = df_bourse["pnl_pourcentage"].apply(
-                            lambda x: f"{x:+.1f}%"
-                        )
+            # PnL réalisé via FIFO
+            pnl_realise_data = _realized_pnl_cached(data_version(), "bourse", symbole_selected)
 
-                        # Renommer les colonnes d'abord
-                        if "type_operation" in df_bourse.columns:
-                            df_display.columns = [
-                                "Date",
-                                "Symbole",
-                                "Type",
-                                "Quantité",
-                                "Prix Achat",
-                                "Investi",
-                                "Prix Actuel",
-                                "Valeur Actuelle",
-                                "P&L €",
-                                "P&L %",
-                            ]
-                        else:
-                            df_display.columns = [
-                                "Date",
-                                "Symbole",
-                                "Quantité",
-                                "Prix Achat",
-                                "Investi",
-                                "Prix Actuel",
-                                "Valeur Actuelle",
-                                "P&L €",
-                                "P&L %",
-                            ]
-
-                        # Appliquer un style conditionnel pour les P&L
-                        def color_pnl(val):
-                            if "+" in str(val):
-                                return "color: green"
-                            elif "-" in str(val):
-                                return "color: red"
-                            return ""
-
-                        # Appliquer le style maintenant que toutes les colonnes sont formatées
-                        styled_df = df_display.style.map(color_pnl, subset=["P&L €", "P&L %"])
-                        st.dataframe(styled_df, use_container_width=True)
-                    else:
-                        if "type_operation" in df_bourse.columns:
-                            df_display.columns = [
-                                "Date",
-                                "Symbole",
-                                "Type",
-                                "Quantité",
-                                "Prix Achat",
-                                "Investi",
-                            ]
-                        else:
-                            df_display.columns = [
-                                "Date",
-                                "Symbole",
-                                "Quantité",
-                                "Prix Achat",
-                                "Investi",
-                            ]
-                        st.dataframe(df_display, use_container_width=True)
-                        st.warning("Impossible de récupérer les prix actuels")
+            # Performance globale du titre
+            if valeurs_actuelles.fillna(0).ne(0).any():
+                valeur_actuelle_symbole = valeurs_actuelles.fillna(df_perf["montant"]).sum()
+                pnl_symbole = valeur_actuelle_symbole - total_investi_symbole
+                pnl_pct_symbole = (
+                    (pnl_symbole / total_investi_symbole * 100) if total_investi_symbole > 0 else 0
+                )
 
-            else:
-                st.info("Aucun investissement bourse enregistré")
+                # Première ligne : Métriques principales
+                _metrics_row(
+                    [
+                        ("Total investi", eur(total_investi_symbole), None),
+                        (
+                            "Valeur actuelle",
+                            eur(valeur_actuelle_symbole),
+                            None,
+                        ),
+                        ("P&L %", "", f"{pnl_pct_symbole:+.1f}%"),
+                        ("P&L €", "", eur_signe(pnl_symbole)),
+                    ]
+                )
 
-        # Section Deep Dive - en dehors des colonnes pour être centrée
-        if data["bourse"]:
-            st.markdown("---")
-
-            # Section Deep Dive
-            st.subheader("📊 Deep Dive")
-
-            # Récupérer les symboles uniques
-            symboles_uniques = sorted(list(set([inv["symbole"] for inv in data["bourse"]])))
-
-            # Récupérer la sélection précédente si elle existe
-            default_index = None
-            if "bourse_deep_dive_symbol" in st.session_state:
-                previous_symbol = st.session_state.bourse_deep_dive_symbol
-                if previous_symbol in symboles_uniques:
-                    default_index = symboles_uniques.index(previous_symbol)
-
-            symbole_selected = st.selectbox(
-                "Sélectionner un titre pour analyse détaillée",
-                options=symboles_uniques,
-                index=default_index,
-                placeholder="-- Choisir un titre --",
+            # Deuxième ligne : Les métriques de détail
+            _metrics_row(
+                [
+                    (
+                        "Prix actuel",
+                        (eur(prix_actuel) if prix_actuel is not None else "N/A"),
+                        None,
+                    ),
+                    ("Prix moyen d'achat", eur(prix_moyen_achat), None),
+                    ("Quantité disponible", f"{quantite_disponible:.4f}", None),
+                ]
             )
 
-            # Sauvegarder la sélection dans session_state
-            if symbole_selected:
-                st.session_state.bourse_deep_dive_symbol = symbole_selected
+            # Nouvelle ligne : Métriques de PnL réalisé/non réalisé
+            if ventes_symbole:  # Afficher seulement s'il y a des ventes
+                st.markdown("#### 💰 Analyse PnL Réalisé vs Non Réalisé")
 
-            if symbole_selected:
-                # Récupérer les données de performance si disponibles
-                bourse_cache_key = f"bourse_perf_{len(data['bourse'])}"
-                bourse_with_perf = st.session_state.get(bourse_cache_key)
+                pnl_realise = pnl_realise_data["pnl_realise_montant"]
+                pnl_realise_pct = pnl_realise_data["pnl_realise_pourcentage"]
+                # PnL non réalisé = PnL actuel - PnL réalisé
+                pnl_non_realise = (
+                    pnl_symbole - pnl_realise if "pnl_symbole" in locals() else -pnl_realise
+                )
+                quantite_vendue = pnl_realise_data["quantite_vendue_totale"]
+
+                # Première ligne : PnL
+                _metrics_row(
+                    [
+                        ("PnL Réalisé €", eur_signe(pnl_realise), None),
+                        ("PnL Réalisé %", f"{pnl_realise_pct:+.1f}%", None),
+                        ("PnL Non Réalisé €", eur_signe(pnl_non_realise), None),
+                        ("Quantité Vendue", f"{quantite_vendue:.4f}", None),
+                    ]
+                )
 
-                # Filtrer les investissements pour ce symbole
-                investissements_symbole = [
-                    inv for inv in data["bourse"] if inv["symbole"] == symbole_selected
-                ]
+                prix_moyen_vente = pnl_realise_data["prix_moyen_vente"]
+                prix_moyen_achat_vendu = pnl_realise_data["prix_moyen_achat_vendu"]
+                # Différence de prix
+                diff_prix = prix_moyen_vente - prix_moyen_achat_vendu
 
-                if bourse_with_perf:
-                    perf_symbole = [
-                        inv for inv in bourse_with_perf if inv["symbole"] == symbole_selected
+                # Deuxième ligne : Prix moyens (dernière case libre pour futur usage)
+                _metrics_row(
+                    [
+                        ("Prix Moyen Vente", eur(prix_moyen_vente), None),
+                        (
+                            "Prix Moyen Achat Vendu",
+                            eur(prix_moyen_achat_vendu),
+                            None,
+                        ),
+                        ("Différence Prix", eur_signe(diff_prix), None),
+                        ("", "", None),
                     ]
-                else:
-                    perf_symbole = investissements_symbole
+                )
+
+                # Tableau détaillé des positions restantes
+                st.markdown("#### 📋 Détail des Positions par Ligne d'Achat (FIFO)")
 
-                # Calculer les statistiques
-                # Quantité réelle disponible (achats - ventes)
-                quantite_disponible = business_logic.calculer_quantite_disponible(
-                    data["bourse"], symbole_selected
+                # Calculées sur les lignes chargées, en cache tant qu'elles ne changent pas
+                positions_restantes = _positions_fifo_cached(
+                    data_version(), "bourse", symbole_selected
                 )
 
-                # Calculs séparés pour achats et ventes
-                achats_symbole = [
-                    inv for inv in investissements_symbole if inv.get("type_operation") != "Vente"
-                ]
-                ventes_symbole = [
-                    inv for inv in investissements_symbole if inv.get("type_operation") == "Vente"
-                ]
+                if positions_restantes:
+                    # Préparer les données pour le tableau
+                    df_pos = pd.DataFrame(positions_restantes)
+                    df_positions = build_positions_table(df_pos)
+                    st.dataframe(df_positions, use_container_width=True, hide_index=True)
+
+                    # Résumé
+                    total_initial = float(df_pos["montant_initial"].sum())
+                    total_restant = float(df_pos["montant_restant"].sum())
+                    total_vendu = total_initial - total_restant
+                    st.info(
+                        f"📈 **Résumé :** {eur(total_vendu)} vendu sur {eur(total_initial)}"
+                        f" initiaux ({total_vendu / total_initial * 100:.1f}%"
+                        f" du portefeuille initial)"
+                    )
 
-                # Total investi = somme des achats seulement
-                # (les ventes ne comptent pas comme investissement)
-                total_investi_symbole = sum([inv["montant"] for inv in achats_symbole])
+            # Graphique d'évolution du prix avec points d'achat
+            st.subheader(f"📈 Évolution du prix - {symbole_selected}")
 
-                # Prix moyen d'achat basé sur les achats seulement
-                total_quantite_achats = sum([inv["quantite"] for inv in achats_symbole])
-                prix_moyen_achat = (
-                    total_investi_symbole / total_quantite_achats
-                    if total_quantite_achats > 0
-                    else 0
+            # Créer le graphique seulement si on a des données de prix
+            if prix_actuel is not None:
+
+                # Préparer les données pour le graphique à partir des colonnes de df_perf
+                # (une opération sans type est un achat)
+                df_graphique = pd.DataFrame(
+                    {
+                        "date": df_perf["date"],
+                        "type_operation": df_perf["type_operation"].fillna("Achat"),
+                        "prix_unitaire": df_perf["prix_unitaire"],
+                        "montant": df_perf["montant"],
+                    }
                 )
 
-                # PnL réalisé via FIFO
-                pnl_realise_data = st.session_state.price_service.calculate_realized_pnl(
-                    data["bourse"], symbole_selected
+                fig = build_price_figure(
+                    symbole_selected, df_graphique, prix_actuel, prix_moyen_achat
                 )
 
-                # Performance globale du titre
-                if perf_symbole and any(inv.get("valeur_actuelle") for inv in perf_symbole):
-                    valeur_actuelle_symbole = sum(
-                        [inv.get("valeur_actuelle", inv["montant"]) for inv in perf_symbole]
-                    )
-                    pnl_symbole = valeur_actuelle_symbole - total_investi_symbole
-                    pnl_pct_symbole = (
-                        (pnl_symbole / total_investi_symbole * 100)
-                        if total_investi_symbole > 0
-                        else 0
-                    )
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("Graphique non disponible - prix actuels non récupérés")
 
-                    # Première ligne : Métriques principales
-                    col1, col2, col3, col4 = st.columns(4)
+            # Tableau détaillé des transactions
+            st.subheader(f"Historique des transactions - {symbole_selected}")
 
-                    with col1:
-                        st.metric(
-                            "Total investi", f"{total_investi_symbole:,.2f}€".replace(",", " ")
-                        )
+            render_transaction_history(df_perf, "{:.4f}".format)
 
-                    with col2:
-                        st.metric(
-                            "Valeur actuelle", f"{valeur_actuelle_symbole:,.2f}€".replace(",", " ")
-                        )
 
-                    with col3:
-                        st.metric("P&L %", "", delta=f"{pnl_pct_symbole:+.1f}%")
+@st.fragment
+def _render_crypto_panel(data, df_crypto_data, crypto_cache_key, existing_symbols_crypto):
+    """Affiche le Deep Dive crypto (sélection de la crypto, métriques, graphique, historique)
 
-                    with col4:
-                        st.metric("P&L €", "", delta=f"{pnl_symbole:+,.2f}€".replace(",", " "))
+    Exécuté comme fragment, comme le Deep Dive bourse : changer de crypto ne relance que ce
+    panneau, et rien n'est calculé tant qu'aucune crypto n'est sélectionnée.
 
-                # Deuxième ligne : Les métriques de détail
-                col1, col2, col3 = st.columns(3)
+    Args:
+        data: Données chargées (dict de listes par table)
+        df_crypto_data: DataFrame des investissements crypto
+        crypto_cache_key: Clé du cache de performances crypto (voir get_perf_cache)
+        existing_symbols_crypto: Liste triée des symboles crypto
+    """
+    # Section Deep Dive - en dehors des colonnes pour être centrée
+    if data["crypto"]:
+        st.markdown("---")
 
-                with col1:
-                    if perf_symbole and any(inv.get("prix_actuel") for inv in perf_symbole):
-                        prix_actuel = next(
-                            (inv["prix_actuel"] for inv in perf_symbole if inv.get("prix_actuel")),
-                            0,
-                        )
-                        st.metric("Prix actuel", f"{prix_actuel:,.2f}€".replace(",", " "))
-                    else:
-                        st.metric("Prix actuel", "N/A")
+        # Section Deep Dive
+        st.subheader("📊 Deep Dive")
+
+        # Récupérer les symboles uniques
+        symboles_uniques_crypto = existing_symbols_crypto
+
+        # Récupérer la sélection précédente si elle existe
+        default_index_crypto = None
+        if "crypto_deep_dive_symbol" in st.session_state:
+            previous_symbol_crypto = st.session_state.crypto_deep_dive_symbol
+            if previous_symbol_crypto in symboles_uniques_crypto:
+                default_index_crypto = symboles_uniques_crypto.index(previous_symbol_crypto)
+
+        symbole_selected_crypto = st.selectbox(
+            "Sélectionner une crypto pour analyse détaillée",
+            options=symboles_uniques_crypto,
+            index=default_index_crypto,
+            placeholder="-- Choisir une crypto --",
+            key="crypto_deep_dive_select",
+        )
 
-                with col2:
-                    st.metric("Prix moyen d'achat", f"{prix_moyen_achat:,.2f}€".replace(",", " "))
+        # Sauvegarder la sélection dans session_state
+        if symbole_selected_crypto:
+            st.session_state.crypto_deep_dive_symbol = symbole_selected_crypto
 
-                with col3:
-                    st.metric("Quantité disponible", f"{quantite_disponible:.4f}")
+        if symbole_selected_crypto:
+            # Récupérer les données de performance si disponibles
+            crypto_with_perf = get_perf_cache(crypto_cache_key)
 
-                # Nouvelle ligne : Métriques de PnL réalisé/non réalisé
-                if ventes_symbole:  # Afficher seulement s'il y a des ventes
-                    st.markdown("#### 💰 Analyse PnL Réalisé vs Non Réalisé")
+            # Filtrer les investissements pour ce symbole
+            investissements_symbole_crypto = [
+                inv for inv in data["crypto"] if inv["symbole"] == symbole_selected_crypto
+            ]
 
-                    # Première ligne : PnL
-                    col1, col2, col3, col4 = st.columns(4)
+            if crypto_with_perf:
+                perf_symbole_crypto = [
+                    inv for inv in crypto_with_perf if inv["symbole"] == symbole_selected_crypto
+                ]
+            else:
+                perf_symbole_crypto = investissements_symbole_crypto
+
+            # Une seule conversion en colonnes pour les métriques du symbole
+            df_perf_crypto = build_performance_frame(perf_symbole_crypto)
+            # Dates parsées une seule fois, en C (graphique et historique)
+            df_perf_crypto["date"] = pd.to_datetime(df_perf_crypto["date"], format="%Y-%m-%d")
+            valeurs_actuelles_crypto = df_perf_crypto["valeur_actuelle"]
+            # Prix actuel : le premier disponible, cherché une seule fois
+            prix_actuels_crypto = df_perf_crypto["prix_actuel"]
+            prix_actuels_crypto = prix_actuels_crypto[
+                prix_actuels_crypto.notna() & prix_actuels_crypto.ne(0)
+            ]
+            prix_actuel_crypto = (
+                prix_actuels_crypto.iloc[0] if not prix_actuels_crypto.empty else None
+            )
 
-                    with col1:
-                        pnl_realise = pnl_realise_data["pnl_realise_montant"]
-                        st.metric("PnL Réalisé €", f"{pnl_realise:+,.2f}€".replace(",", " "))
+            # Calculer les statistiques
+            # Totaux achats/ventes du symbole (zéro s'il n'a plus de ligne dans la table)
+            stats_symbole_crypto = build_symbol_stats(df_crypto_data, symbole_selected_crypto)
+            ventes_symbole_crypto = stats_symbole_crypto[("nombre", True)] > 0
 
-                    with col2:
-                        pnl_realise_pct = pnl_realise_data["pnl_realise_pourcentage"]
-                        st.metric("PnL Réalisé %", f"{pnl_realise_pct:+.1f}%")
+            # Quantité réelle disponible (achats - ventes), jamais négative
+            quantite_disponible_crypto = max(
+                0.0,
+                stats_symbole_crypto[("quantite", False)]
+                - stats_symbole_crypto[("quantite", True)],
+            )
 
-                    with col3:
-                        # PnL non réalisé = PnL actuel - PnL réalisé
-                        pnl_non_realise = (
-                            pnl_symbole - pnl_realise if "pnl_symbole" in locals() else -pnl_realise
-                        )
-                        st.metric(
-                            "PnL Non Réalisé €", f"{pnl_non_realise:+,.2f}€".replace(",", " ")
-                        )
+            # Total investi = somme des achats seulement
+            # (les ventes ne comptent pas comme investissement)
+            total_investi_symbole_crypto = stats_symbole_crypto[("montant", False)]
 
-                    with col4:
-                        quantite_vendue = pnl_realise_data["quantite_vendue_totale"]
-                        st.metric("Quantité Vendue", f"{quantite_vendue:.4f}")
+            # Prix moyen d'achat basé sur les achats uniquement
+            prix_moyen_achat_crypto = (
+                total_investi_symbole_crypto / stats_symbole_crypto[("quantite", False)]
+                if stats_symbole_crypto[("nombre", False)] > 0
+                else 0
+            )
 
-                    # Deuxième ligne : Prix moyens
-                    col1, col2, col3, col4 = st.columns(4)
+            # PnL réalisé via FIFO
+            pnl_realise_data_crypto = _realized_pnl_cached(
+                data_version(), "crypto", symbole_selected_crypto
+            )
 
-                    with col1:
-                        prix_moyen_vente = pnl_realise_data["prix_moyen_vente"]
-                        st.metric("Prix Moyen Vente", f"{prix_moyen_vente:,.2f}€".replace(",", " "))
+            # Performance globale du titre
+            if valeurs_actuelles_crypto.fillna(0).ne(0).any():
+                # Valeur actuelle = somme des valeurs actuelles
+                # des achats seulement (ventes = 0)
+                achats_crypto = df_perf_crypto["type_operation"].ne("Vente")
+                valeur_actuelle_symbole_crypto = (
+                    valeurs_actuelles_crypto[achats_crypto]
+                    .fillna(df_perf_crypto.loc[achats_crypto, "montant"])
+                    .sum()
+                )
 
-                    with col2:
-                        prix_moyen_achat_vendu = pnl_realise_data["prix_moyen_achat_vendu"]
-                        st.metric(
-                            "Prix Moyen Achat Vendu",
-                            f"{prix_moyen_achat_vendu:,.2f}€".replace(",", " "),
-                        )
+                # PnL non réalisé (différence valeur actuelle vs investissement)
+                pnl_non_realise_crypto = (
+                    valeur_actuelle_symbole_crypto - total_investi_symbole_crypto
+                )
 
-                    with col3:
-                        # Différence de prix
-                        diff_prix = prix_moyen_vente - prix_moyen_achat_vendu
-                        st.metric("Différence Prix", f"{diff_prix:+,.2f}€".replace(",", " "))
+                # PnL total = réalisé + non réalisé
+                pnl_symbole_crypto = (
+                    pnl_realise_data_crypto["pnl_realise_montant"] + pnl_non_realise_crypto
+                )
+                pnl_pct_symbole_crypto = (
+                    (pnl_symbole_crypto / total_investi_symbole_crypto * 100)
+                    if total_investi_symbole_crypto > 0
+                    else 0
+                )
 
-                    with col4:
-                        # Espace libre pour futur usage
-                        st.metric("", "")
+                # Première ligne : Métriques principales
+                _metrics_row(
+                    [
+                        ("Total investi", eur(total_investi_symbole_crypto), None),
+                        ("Valeur actuelle", eur(valeur_actuelle_symbole_crypto), None),
+                        ("P&L %", "", f"{pnl_pct_symbole_crypto:+.1f}%"),
+                        ("P&L €", "", eur_signe(pnl_symbole_crypto)),
+                    ]
+                )
 
-                    # Tableau détaillé des positions restantes
-                    st.markdown("#### 📋 Détail des Positions par Ligne d'Achat (FIFO)")
-
-                    # SOLUTION: Récupérer directement les données
-                    # depuis Supabase pour éviter les corruptions
-                    raw_data = (
-                        supabase.table("bourse")
-                        .select("*")
-                        .eq("symbole", symbole_selected.upper())
-                        .execute()
-                        .data
+                # Affichage détaillé du PnL si il y a des ventes
+                if ventes_symbole_crypto:
+                    st.markdown("#### 💰 Analyse PnL Réalisé vs Non Réalisé")
+
+                    pnl_realise_crypto = pnl_realise_data_crypto["pnl_realise_montant"]
+                    pnl_realise_pct_crypto = pnl_realise_data_crypto["pnl_realise_pourcentage"]
+                    quantite_vendue_crypto = pnl_realise_data_crypto["quantite_vendue_totale"]
+
+                    # Première ligne : PnL
+                    _metrics_row(
+                        [
+                            ("PnL Réalisé €", eur_signe(pnl_realise_crypto), None),
+                            ("PnL Réalisé %", f"{pnl_realise_pct_crypto:+.1f}%", None),
+                            ("PnL Non Réalisé €", eur_signe(pnl_non_realise_crypto), None),
+                            ("Quantité Vendue", f"{quantite_vendue_crypto:.8f}", None),
+                        ]
+                    )
+
+                    prix_moyen_vente_crypto = pnl_realise_data_crypto["prix_moyen_vente"]
+                    prix_moyen_achat_vendu_crypto = pnl_realise_data_crypto[
+                        "prix_moyen_achat_vendu"
+                    ]
+                    # Différence de prix
+                    diff_prix_crypto = prix_moyen_vente_crypto - prix_moyen_achat_vendu_crypto
+
+                    # Deuxième ligne : Prix moyens (dernière case libre pour futur usage)
+                    _metrics_row(
+                        [
+                            ("Prix Moyen Vente", eur(prix_moyen_vente_crypto), None),
+                            ("Prix Moyen Achat Vendu", eur(prix_moyen_achat_vendu_crypto), None),
+                            ("Différence Prix", eur_signe(diff_prix_crypto), None),
+                            ("", "", None),
+                        ]
                     )
 
-                    positions_restantes = business_logic.calculer_positions_restantes_fifo(
-                        raw_data, symbole_selected
+                    # Tableau détaillé des positions restantes
+                    st.markdown("#### 📋 Détail des Positions" " par Ligne d'Achat (FIFO)")
+                    # Calculées sur les lignes chargées, en cache tant qu'elles ne changent pas
+                    positions_restantes_crypto = _positions_fifo_cached(
+                        data_version(), "crypto", symbole_selected_crypto
                     )
 
-                    if positions_restantes:
+                    if positions_restantes_crypto:
                         # Préparer les données pour le tableau
-                        tableau_positions = []
-                        for pos in positions_restantes:
-                            date_obj = datetime.strptime(pos["date"], "%Y-%m-%d")
-                            tableau_positions.append(
-                                {
-                                    "Date": date_obj.strftime("%d/%m/%Y"),
-                                    "Type": pos["type_operation"],
-                                    "Prix €": f"{pos['prix_unitaire']:,.2f}".replace(",", " "),
-                                    "Quantité Initiale": f"{pos['quantite_initiale']:.4f}",
-                                    "Quantité Restante": f"{pos['quantite_restante']:.4f}",
-                                    "Valeur Restante €": f"{pos['montant_restant']:,.2f}".replace(
-                                        ",", " "
-                                    ),
-                                    "% Vendu": (
-                                        f"{((pos['quantite_initiale'] - pos['quantite_restante'])
-                                            / pos['quantite_initiale'] * 100):.1f}%"
-                                        if pos["quantite_initiale"] > 0
-                                        else "0%"
-                                    ),
-                                }
-                            )
-
-                        df_positions = pd.DataFrame(tableau_positions)
-                        st.dataframe(df_positions, use_container_width=True, hide_index=True)
+                        df_pos_crypto = pd.DataFrame(positions_restantes_crypto)
+                        df_positions_crypto = build_positions_table(
+                            df_pos_crypto, decimales_quantite=8
+                        )
+                        st.dataframe(df_positions_crypto, use_container_width=True, hide_index=True)
 
                         # Résumé
-                        total_initial = sum([pos["montant_initial"] for pos in positions_restantes])
-                        total_restant = sum([pos["montant_restant"] for pos in positions_restantes])
-                        total_vendu = total_initial - total_restant
+                        total_initial_crypto = float(df_pos_crypto["montant_initial"].sum())
+                        total_restant_crypto = float(df_pos_crypto["montant_restant"].sum())
+                        total_vendu_crypto = total_initial_crypto - total_restant_crypto
                         st.info(
-                            f"📈 **Résumé :** {total_vendu:,.2f}€ vendu sur {total_initial:,.2f}€"
-                            f" initiaux ({total_vendu / total_initial * 100:.1f}%"
-                            f" du portefeuille initial)".replace(",", " ")
+                            f"📈 **Résumé :** {eur(total_vendu_crypto)} vendu"
+                            f" sur {eur(total_initial_crypto)} initiaux"
+                            f" ({total_vendu_crypto / total_initial_crypto * 100:.1f}"
+                            f"% du portefeuille initial)"
                         )
 
-                # Graphique d'évolution du prix avec points d'achat
-                st.subheader(f"📈 Évolution du prix - {symbole_selected}")
-
-                # Créer le graphique seulement si on a des données de prix
-                if perf_symbole and any(inv.get("prix_actuel") for inv in perf_symbole):
-
-                    # Préparer les données pour le graphique
-                    dates_achat = [
-                        datetime.strptime(inv["date"], "%Y-%m-%d")
-                        for inv in investissements_symbole
-                    ]
-                    prix_achat = [inv["prix_unitaire"] for inv in investissements_symbole]
-                    montants_achat = [inv["montant"] for inv in investissements_symbole]
-                    types_operation = [
-                        inv.get("type_operation", "Achat") for inv in investissements_symbole
-                    ]
-
-                    # Prix actuel (on prend le premier disponible)
-                    prix_actuel = next(
-                        (inv["prix_actuel"] for inv in perf_symbole if inv.get("prix_actuel")), 0
-                    )
+            # Deuxième ligne : Les métriques de détail
+            _metrics_row(
+                [
+                    (
+                        "Prix actuel",
+                        (eur(prix_actuel_crypto) if prix_actuel_crypto is not None else "N/A"),
+                        None,
+                    ),
+                    ("Prix moyen d'achat", eur(prix_moyen_achat_crypto), None),
+                    ("Quantité disponible", f"{quantite_disponible_crypto:.8f}", None),
+                ]
+            )
 
-                    fig = go.Figure()
+            # Graphique d'évolution du prix avec points d'achat
+            st.subheader(f"📈 Évolution du prix - {symbole_selected_crypto}")
 
-                    # Ligne horizontale pour le prix actuel
-                    fig.add_hline(
-                        y=prix_actuel,
-                        line_dash="dash",
-                        line_color="blue",
-                        annotation_text=f"Prix actuel: {prix_actuel:,.2f}€".replace(",", " "),
-                        annotation_position="bottom right",
-                    )
+            # Créer le graphique seulement si on a des données de prix
+            if prix_actuel_crypto is not None:
 
-                    # Séparer les données par type d'opération
-                    types_uniques = list(set(types_operation))
-                    colors = {
-                        "Achat": "#22C55E",
-                        "RoundUP": "#22C55E",
-                        "SaveBack": "#22C55E",
-                        "Vente": "#EF4444",
-                    }
-                    shapes = {
-                        "Achat": "circle",
-                        "RoundUP": "diamond",
-                        "SaveBack": "square",
-                        "Vente": "triangle-down",
+                # Même graphique que pour la bourse : un groupby par type d'opération
+                # (une opération sans type est un achat), figure mise en cache
+                df_graphique_crypto = pd.DataFrame(
+                    {
+                        "date": df_perf_crypto["date"],
+                        "type_operation": df_perf_crypto["type_operation"].fillna("Achat"),
+                        "prix_unitaire": df_perf_crypto["prix_unitaire"],
+                        "montant": df_perf_crypto["montant"],
                     }
+                )
+                fig_crypto = build_price_figure(
+                    symbole_selected_crypto,
+                    df_graphique_crypto,
+                    prix_actuel_crypto,
+                    prix_moyen_achat_crypto,
+                )
 
-                    for type_op in types_uniques:
-                        # Filtrer les données pour ce type d'opération
-                        indices = [i for i, t in enumerate(types_operation) if t == type_op]
-                        dates_type = [dates_achat[i] for i in indices]
-                        prix_type = [prix_achat[i] for i in indices]
-                        montants_type = [montants_achat[i] for i in indices]
-
-                        color = colors.get(type_op, "gray")
-                        shape = shapes.get(type_op, "circle")
-
-                        # Préparer les hover texts - TEMPORAIREMENT COMMENTÉ
-                        # hover_texts = []
-                        # for date, prix, montant
-                        # in zip(dates_type, prix_type, montants_type):
-                        #     base_text = f"Date:
-                        #     {date.strftime('%d/%m/%Y')}<br>Type: {type_op}<br>Prix: {prix:
-                        #     ,.2f}€<br>Montant: {montant:,.2f}€".replace(",", " ")
-                        #
-                        #     if type_op == "Vente":
-                        #         # Pour les ventes, ajouter le PnL réalisé
-                        #         pnl_realise_data =
-                        #         st.session_state.price_service.calculate_realized_pnl(
-                        #             data["bourse"], symbole_selected
-                        #         )
-                        #         base_text += f"<br>PnL réalisé:
-                        #         {pnl_realise_data['pnl_realise_montant']
-                        #         :+,.2f}€".replace(",", " ")
-                        #
-                        #     hover_texts.append(base_text)
-
-                        # Version simplifiée temporaire
-                        hover_texts = [
-                            (
-                                f"Date: {date.strftime('%d/%m/%Y')}<br>Type: {type_op}"
-                                f"<br>Prix: {prix:,.2f}€<br>Montant: {montant:,.2f}€"
-                            ).replace(",", " ")
-                            for date, prix, montant in zip(dates_type, prix_type, montants_type)
-                        ]
-
-                        fig.add_trace(
-                            go.Scatter(
-                                x=dates_type,
-                                y=prix_type,
-                                mode="markers",
-                                marker=dict(
-                                    size=7.5,
-                                    color=color,
-                                    symbol=shape,
-                                    line=dict(width=2, color=color),
-                                ),
-                                name=type_op,
-                                text=hover_texts,
-                                hovertemplate="%{text}<extra></extra>",
-                            )
-                        )
+                st.plotly_chart(fig_crypto, use_container_width=True)
+            else:
+                st.info("Graphique non disponible - prix actuels non récupérés")
 
-                    # Ligne du prix moyen d'achat (uniquement si on a des achats)
-                    if prix_moyen_achat > 0:
-                        fig.add_hline(
-                            y=prix_moyen_achat,
-                            line_dash="dot",
-                            line_color="green",
-                            annotation_text=f"Prix moyen d'achat: {prix_moyen_achat:,.2f}€".replace(
-                                ",", " "
-                            ),
-                            annotation_position="top right",
-                        )
+            # Tableau détaillé des transactions
+            st.subheader(f"Historique des transactions - {symbole_selected_crypto}")
 
-                    fig.update_layout(
-                        title=f"Évolution des prix d'achat - {symbole_selected}",
-                        xaxis_title="Date",
-                        yaxis_title="Prix (€)",
-                        hovermode="closest",
-                        showlegend=True,
-                        height=400,
-                    )
+            render_transaction_history(df_perf_crypto, "{:.8f}".format)
 
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info("Graphique non disponible - prix actuels non récupérés")
 
-                # Tableau détaillé des transactions
-                st.subheader(f"Historique des transactions - {symbole_selected}")
+@st.fragment
+def _render_revenu_form(periodes_existantes):
+    """Formulaire de saisie des revenus (barre latérale)
 
-                df_symbole = pd.DataFrame(perf_symbole)
-                # Trier par date AVANT la conversion en format d'affichage
-                df_symbole["date"] = pd.to_datetime(df_symbole["date"])
-                df_symbole = df_symbole.sort_values(
-                    "date", ascending=False
-                )  # Plus récent en premier
-                df_symbole["date"] = df_symbole["date"].dt.strftime("%d/%m/%Y")
+    Exécuté comme fragment : saisir un montant ou changer de mois ne relance que le
+    formulaire. Seul l'enregistrement relance toute la page.
 
-                # Préparer les colonnes d'affichage
-                colonnes_base = ["date", "quantite", "prix_unitaire", "montant"]
+    Args:
+        periodes_existantes: Ensemble des périodes ("YYYY-MM") déjà saisies
+    """
+    st.header("Saisie des Revenus")
 
-                # Ajouter type_operation si disponible
-                if "type_operation" in df_symbole.columns:
-                    colonnes_base.insert(1, "type_operation")
+    revenu_net = st.number_input(
+        "Revenu net mensuel (€)",
+        min_value=0,
+        value=0,
+        step=100,
+        help="Saisissez votre revenu net mensuel",
+    )
 
-                df_display_symbole = df_symbole[colonnes_base].copy()
+    col_mois, col_annee = st.columns(2)
+    with col_mois:
+        mois_revenu = st.selectbox(
+            "Mois",
+            options=MOIS_OPTIONS,
+            format_func=lambda x: MOIS_NOMS[x - 1],
+            index=date.today().month - 1,
+        )
+    with col_annee:
+        annee_revenu = st.number_input(
+            "Année", min_value=2020, max_value=2030, value=date.today().year, step=1
+        )
 
-                # Formatage
-                df_display_symbole["montant"] = df_display_symbole["montant"].apply(
-                    lambda x: f"{x:,.2f}€".replace(",", " ")
-                )
-                df_display_symbole["prix_unitaire"] = df_display_symbole["prix_unitaire"].apply(
-                    lambda x: f"{x:,.2f}€".replace(",", " ")
-                )
-                df_display_symbole["quantite"] = df_display_symbole["quantite"].apply(
-                    lambda x: f"{x:.4f}"
-                )
+    if st.button("Enregistrer Revenu"):
+        if revenu_net > 0:
+            periode_actuelle = f"{annee_revenu}-{mois_revenu:02d}"
 
-                # Ajouter les colonnes de performance si disponibles
-                if (
-                    "prix_actuel" in df_symbole.columns
-                    and "pnl_montant" in df_symbole.columns
-                    and "pnl_pourcentage" in df_symbole.columns
-                ):
-                    df_display_symbole["prix_actuel"] = df_symbole["prix_actuel"].apply(
-                        lambda x: f"{x:,.2f}€".replace(",", " ") if x is not None else "N/A"
-                    )
-                    df_display_symbole["valeur_actuelle"] = df_symbole["valeur_actuelle"].apply(
-                        lambda x: f"{x:,.2f}€".replace(",", " ")
-                    )
-                    df_display_symbole["pnl_montant"] = df_symbole["pnl_montant"].apply(
-                        lambda x: f"{x:+,.2f}€".replace(",", " ")
+            # Vérifier si le revenu pour cette période existe déjà
+            if periode_actuelle in periodes_existantes:
+                st.error(f"Un revenu pour {periode_actuelle} existe déjà!")
+            else:
+                montant_investissement_bourse = round(revenu_net * 0.10, 2)
+                montant_investissement_crypto = round(revenu_net * 0.10, 2)
+                nouveau_revenu = {
+                    "mois": mois_revenu,
+                    "annee": int(annee_revenu),
+                    "periode": periode_actuelle,
+                    "montant": revenu_net,
+                    "investissement_disponible_bourse": montant_investissement_bourse,
+                    "investissement_disponible_crypto": montant_investissement_crypto,
+                }
+                # Ajouter à Supabase : la contrainte UNIQUE(periode) ignore les doublons
+                # qui auraient échappé au contrôle local (saisie depuis une autre session)
+                try:
+                    resultat = (
+                        supabase.table("revenus")
+                        .upsert(nouveau_revenu, on_conflict="periode", ignore_duplicates=True)
+                        .execute()
                     )
-                    df_display_symbole["pnl_pourcentage"] = df_symbole["pnl_pourcentage"].apply(
-                        lambda x: f"{x:+.1f}%"
+                    if resultat.data:
+                        invalidate_data()
+                except Exception as e:
+                    st.error(f"Erreur lors de l'ajout du revenu: {e}")
+                    return
+                if not resultat.data:
+                    st.error(f"Un revenu pour {periode_actuelle} existe déjà!")
+                else:
+                    st.toast(
+                        f"Revenu enregistré! {eur(montant_investissement_bourse)} pour bourse,"
+                        f" {eur(montant_investissement_crypto)} pour crypto"
                     )
+                    st.rerun()
 
-                    # Renommer les colonnes
-                    if "type_operation" in df_symbole.columns:
-                        df_display_symbole.columns = [
-                            "Date",
-                            "Type",
-                            "Quantité",
-                            "Prix Achat",
-                            "Investi",
-                            "Prix Actuel",
-                            "Valeur Actuelle",
-                            "P&L €",
-                            "P&L %",
-                        ]
-                    else:
-                        df_display_symbole.columns = [
-                            "Date",
-                            "Quantité",
-                            "Prix Achat",
-                            "Investi",
-                            "Prix Actuel",
-                            "Valeur Actuelle",
-                            "P&L €",
-                            "P&L %",
-                        ]
-
-                    # Appliquer le style conditionnel
-                    def color_pnl(val):
-                        if "+" in str(val):
-                            return "color: green"
-                        elif "-" in str(val):
-                            return "color: red"
-                        return ""
-
-                    styled_df_symbole = df_display_symbole.style.map(
-                        color_pnl, subset=["P&L €", "P&L %"]
-                    )
-                    st.dataframe(styled_df_symbole, use_container_width=True)
-                else:
-                    if "type_operation" in df_symbole.columns:
-                        df_display_symbole.columns = [
-                            "Date",
-                            "Type",
-                            "Quantité",
-                            "Prix Achat",
-                            "Investi",
-                        ]
-                    else:
-                        df_display_symbole.columns = [
-                            "Date",
-                            "Quantité",
-                            "Prix Achat",
-                            "Investi",
-                        ]
-                    st.dataframe(df_display_symbole, use_container_width=True)
 
-    with tab_crypto:
-        st.header("Investissements Crypto")
+@st.fragment
+def _render_bourse_form(data, bourse_cache_key, existing_symbols_bourse):
+    """Formulaire d'ajout d'un achat ou d'une vente bourse
+
+    Exécuté comme fragment : les saisies ne relancent que le formulaire, pas les onglets ni
+    le calcul des performances. Un ajout réussi relance toute la page (st.rerun).
+
+    Args:
+        data: Données chargées (dict de listes par table)
+        bourse_cache_key: Clé du cache de performances bourse (voir get_perf_cache)
+        existing_symbols_bourse: Liste triée des symboles bourse
+    """
+    price_service = get_price_service()
+
+    st.subheader("Nouvel investissement")
+
+    # Saisie du symbole avec liste déroulante
+    if existing_symbols_bourse:
+        # Utiliser un selectbox avec les symboles existants + option "Autre"
+        options = existing_symbols_bourse + ["🆕 Autre symbole..."]
+        symbole_choice = st.selectbox(
+            "Symbole",
+            options=options,
+            index=None,
+            placeholder="-- Choisir un symbole --",
+            help="Choisissez un symbole existant ou 'Autre symbole...' " "pour saisir manuellement",
+        )
 
-        # Métriques spécifiques crypto
-        col_m1, col_m2, col_m3, col_m4, col_m5 = st.columns(5)
-        with col_m1:
-            st.metric("Budget Crypto", f"{budget_crypto:,}€".replace(",", " "))
-        with col_m2:
-            st.metric("Investi Crypto", f"{total_investi_crypto:,.2f}€".replace(",", " "))
-        with col_m3:
-            st.metric("Restant Crypto", f"{budget_restant_crypto:,.2f}€".replace(",", " "))
-        with col_m4:
-            # Calculer la valeur actuelle à partir des données individuelles si disponibles
-            crypto_cache_key = f"crypto_perf_{len(data['crypto'])}"
-            crypto_with_perf = st.session_state.get(crypto_cache_key)
+        if symbole_choice == "🆕 Autre symbole...":
+            symbole_bourse = st.text_input(
+                "Nouveau symbole",
+                placeholder="Ex: NVIDIA, AAPL, HIWS...",
+                help="Tapez le nom ou symbole de l'action",
+                label_visibility="collapsed",
+            )
+        elif symbole_choice is not None:
+            symbole_bourse = symbole_choice
+        else:
+            symbole_bourse = ""
+    else:
+        # Si aucun symbole existant, saisie directe
+        symbole_bourse = st.text_input(
+            "Symbole",
+            placeholder="Ex: NVIDIA, AAPL, HIWS...",
+            help="Tapez le nom ou symbole de l'action",
+        )
 
-            if crypto_with_perf and any(inv.get("valeur_actuelle") for inv in crypto_with_perf):
-                valeur_actuelle_crypto = sum(
-                    inv.get("valeur_actuelle", inv["montant"]) for inv in crypto_with_perf
-                )
-                st.metric("Valeur Actuelle", f"{valeur_actuelle_crypto:,.2f}€".replace(",", " "))
-            elif portfolio_summary and portfolio_summary["crypto"]["valeur_actuelle"] > 0:
-                valeur_actuelle_crypto = portfolio_summary["crypto"]["valeur_actuelle"]
-                st.metric("Valeur Actuelle", f"{valeur_actuelle_crypto:,.2f}€".replace(",", " "))
-            else:
-                st.metric("Valeur Actuelle", f"{total_investi_crypto:,.2f}€".replace(",", " "))
-        with col_m5:
-            # Calculer le P&L à partir des données individuelles si disponibles
-            if crypto_with_perf and any(
-                inv.get("pnl_montant") is not None for inv in crypto_with_perf
-            ):
-                pnl_crypto = sum(
-                    inv.get("pnl_montant", 0)
-                    for inv in crypto_with_perf
-                    if inv.get("pnl_montant") is not None
-                )
-                pnl_pct_crypto = (
-                    (pnl_crypto / total_investi_crypto * 100) if total_investi_crypto > 0 else 0
-                )
-                st.metric(
-                    "P&L Total",
-                    f"{pnl_crypto:+,.2f}€".replace(",", " "),
-                    delta=f"{pnl_pct_crypto:+.1f}%",
-                )
-            elif portfolio_summary and portfolio_summary["crypto"]["pnl_montant"] is not None:
-                pnl_crypto = portfolio_summary["crypto"]["pnl_montant"]
-                pnl_pct_crypto = portfolio_summary["crypto"]["pnl_pourcentage"]
-                st.metric(
-                    "P&L Total",
-                    f"{pnl_crypto:+,.2f}€".replace(",", " "),
-                    delta=f"{pnl_pct_crypto:+.1f}%",
-                )
-            else:
-                st.metric("P&L Total", "0€", delta="0.0%")
+    hors_budget_bourse = st.checkbox(
+        "Hors budget (conversion/existant)",
+        help="Cochez si c'est un investissement existant "
+        "ou une conversion qui ne doit pas être déduit du budget",
+        key="bourse_hors_budget",
+    )
 
-        st.markdown("---")
+    # Type d'opération
+    type_operation_bourse = st.selectbox(
+        "Type d'opération",
+        options=["Achat", "Vente", "RoundUP", "SaveBack"],
+        index=0,
+        help="Sélectionnez le type d'opération (achat, vente, roundup, ou saveback)",
+        key="bourse_type_operation",
+    )
 
-        col1, col2 = st.columns([1, 2])
+    montant_bourse = st.number_input(
+        "Montant (€)",
+        min_value=0.0,
+        value=None,
+        step=10.0,
+        key="bourse_montant",
+        help="Saisissez le montant de votre investissement",
+    )
+    date_bourse = st.date_input("Date d'achat", key="bourse_date")
+    prix_unitaire_bourse = st.number_input(
+        "Prix unitaire (€)", min_value=0.0, value=None, step=0.01, key="bourse_prix"
+    )
 
-        with col1:
-            st.subheader("Nouvel investissement")
-
-            # Saisie du symbole avec liste déroulante
-            existing_symbols_crypto = get_existing_symbols(data, "crypto")
-
-            if existing_symbols_crypto:
-                # Utiliser un selectbox avec les symboles existants + option "Autre"
-                crypto_options = existing_symbols_crypto + ["🆕 Autre symbole..."]
-                symbole_choice_crypto = st.selectbox(
-                    "Symbole",
-                    options=crypto_options,
-                    index=None,
-                    placeholder="-- Choisir un symbole --",
-                    help="Choisissez un symbole existant ou 'Autre symbole...' "
-                    "pour saisir manuellement",
-                    key="crypto_symbole_select",
-                )
+    # Interface de choix si plusieurs options trouvées
+    if hasattr(st.session_state, "symbol_choices") and st.session_state.symbol_choices:
+        st.subheader(f"Choisir le symbole pour '{st.session_state.pending_symbol}':")
 
-                if symbole_choice_crypto == "🆕 Autre symbole...":
-                    symbole_crypto = st.text_input(
-                        "Nouveau symbole crypto",
-                        placeholder="Ex: BTC, ETH, ADA...",
-                        help="Tapez le nom ou symbole de la crypto",
-                        key="crypto_symbole_input",
-                        label_visibility="collapsed",
-                    )
-                elif symbole_choice_crypto is not None:
-                    symbole_crypto = symbole_choice_crypto
-                else:
-                    symbole_crypto = ""
-            else:
-                # Si aucun symbole existant, saisie directe
-                symbole_crypto = st.text_input(
-                    "Symbole",
-                    placeholder="Ex: BTC, ETH, ADA...",
-                    help="Tapez le nom ou symbole de la crypto",
-                    key="crypto_symbole_input",
-                )
-            hors_budget_crypto = st.checkbox(
-                "Hors budget (conversion/existant)",
-                help="Cochez si c'est un investissement existant "
-                "ou une conversion qui ne doit pas être déduit du budget",
-                key="crypto_hors_budget",
-            )
+        choices = st.session_state.symbol_choices
+        choice_labels = []
 
-            # Type d'opération
-            type_operation_crypto = st.selectbox(
-                "Type d'opération",
-                options=["Achat", "Vente", "RoundUP", "SaveBack"],
-                index=0,
-                help="Sélectionnez le type d'opération (achat, vente, roundup, ou saveback)",
-                key="crypto_type_operation",
-            )
+        for i, (variant, price, market, company) in enumerate(choices):
+            label = f"{variant} ({market}) - {company} - {price:.2f}€"
+            choice_labels.append(label)
 
-            montant_crypto = st.number_input(
-                "Montant (€)",
-                min_value=0.0,
-                value=None,
-                step=10.0,
-                key="crypto_montant",
-                help="Saisissez le montant de votre investissement",
-            )
-            date_crypto = st.date_input("Date d'achat", key="crypto_date")
-            prix_unitaire_crypto = st.number_input(
-                "Prix unitaire (€)", min_value=0.0, value=None, step=0.01, key="crypto_prix"
-            )
+        selected_choice = st.radio(
+            "Symboles trouvés:",
+            options=range(len(choices)),
+            format_func=lambda x: choice_labels[x],
+            key="symbol_choice_radio",
+        )
 
-            if st.button("Ajouter Investissement Crypto"):
-                if symbole_crypto and (montant_crypto or 0) > 0 and (prix_unitaire_crypto or 0) > 0:
-
-                    if type_operation_crypto == "Vente":
-                        # Validation spécifique pour les ventes
-                        quantite_vente = montant_crypto / prix_unitaire_crypto
-                        erreurs = business_logic.valider_donnees_vente(
-                            montant_crypto,
-                            prix_unitaire_crypto,
-                            symbole_crypto,
-                            quantite_vente,
-                            data["crypto"],
-                        )
+        col_choose, col_cancel = st.columns(2)
 
-                        if erreurs:
-                            for erreur in erreurs:
-                                st.error(erreur)
-                        else:
-                            # Créer les données de vente
-                            donnees_vente = business_logic.creer_donnees_vente(
-                                date_crypto.isoformat(),
-                                symbole_crypto,
-                                montant_crypto,
-                                prix_unitaire_crypto,
-                            )
+        with col_choose:
+            if st.button("✅ Utiliser ce symbole", key="confirm_choice"):
+                chosen_variant, chosen_price, chosen_market, chosen_company = choices[
+                    selected_choice
+                ]
 
-                            try:
-                                supabase.table("crypto").insert(donnees_vente).execute()
-
-                                # Recharger les données
-                                data = load_data()
-                                save_data(data)
-
-                                # Vider tous les caches de performance qui pourraient être corrompus
-                                keys_to_remove = [
-                                    key
-                                    for key in st.session_state.keys()
-                                    if "perf" in key or "cache" in key
-                                ]
-                                for key in keys_to_remove:
-                                    del st.session_state[key]
-
-                                st.success("Vente crypto ajoutée!")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Erreur lors de l'ajout de la vente crypto: {e}")
-                    else:
-                        # Validation standard pour les achats
-                        erreurs = business_logic.valider_donnees_investissement(
-                            montant_crypto, prix_unitaire_crypto, symbole_crypto
-                        )
+                # Sauvegarder le choix
+                final_price = price_service.save_user_choice(
+                    st.session_state.pending_symbol, chosen_variant, chosen_company
+                )
 
-                        if erreurs:
-                            for erreur in erreurs:
-                                st.error(erreur)
-                        else:
-                            # Créer les données d'investissement standard
-                            donnees_investissement = business_logic.creer_donnees_investissement(
-                                date_crypto.isoformat(),
-                                symbole_crypto,
-                                montant_crypto,
-                                prix_unitaire_crypto,
-                                hors_budget_crypto,
-                            )
-                            # Ajouter le type d'opération
-                            donnees_investissement["type_operation"] = type_operation_crypto
+                if final_price:
+                    st.toast(
+                        f"💾 Choix sauvegardé ! {st.session_state.pending_symbol} → "
+                        f"{chosen_variant} ({final_price:.2f}€)"
+                    )
 
-                            try:
-                                supabase.table("crypto").insert(donnees_investissement).execute()
+                # Nettoyer les variables de session
+                del st.session_state.symbol_choices
+                del st.session_state.pending_symbol
+                st.rerun()
 
-                                # Recharger les données
-                                data = load_data()
-                                save_data(data)
-                                st.success("Investissement crypto ajouté!")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Erreur lors de l'ajout de l'investissement crypto: {e}")
+        with col_cancel:
+            if st.button("❌ Annuler", key="cancel_choice"):
+                del st.session_state.symbol_choices
+                del st.session_state.pending_symbol
+                st.rerun()
 
-        with col2:
-            if data["crypto"]:
-                st.subheader("Portfolio Crypto")
+    if st.button("Ajouter Investissement Bourse"):
+        if symbole_bourse and (montant_bourse or 0) > 0 and (prix_unitaire_bourse or 0) > 0:
+
+            if type_operation_bourse == "Vente":
+                # Validation spécifique pour les ventes
+                quantite_vente = montant_bourse / prix_unitaire_bourse
+                erreurs = business_logic.valider_donnees_vente(
+                    montant_bourse,
+                    prix_unitaire_bourse,
+                    symbole_bourse,
+                    quantite_vente,
+                    data["bourse"],
+                )
 
-                # Calculer les performances avec prix actuels seulement si nécessaire
-                crypto_cache_key = f"crypto_perf_{len(data['crypto'])}"
-                if crypto_cache_key not in st.session_state:
-                    with st.spinner("Récupération des prix crypto actuels..."):
-                        crypto_with_perf = (
-                            st.session_state.price_service.calculate_investment_performance(
-                                data["crypto"], "crypto"
-                            )
-                        )
-                        st.session_state[crypto_cache_key] = crypto_with_perf
+                if erreurs:
+                    for erreur in erreurs:
+                        st.error(erreur)
                 else:
-                    crypto_with_perf = st.session_state[crypto_cache_key]
-
-                if crypto_with_perf:
-                    df_crypto = pd.DataFrame(crypto_with_perf)
-                    # Trier par date AVANT la conversion en format d'affichage
-                    df_crypto["date"] = pd.to_datetime(df_crypto["date"])
-                    df_crypto = df_crypto.sort_values(
-                        "date", ascending=False
-                    )  # Plus récent en premier
-                    df_crypto["date"] = df_crypto["date"].dt.strftime("%d/%m/%Y")
-
-                    # Préparer les colonnes d'affichage
-                    colonnes_base = ["date", "symbole", "quantite", "prix_unitaire", "montant"]
-
-                    # Ajouter type_operation si disponible
-                    if "type_operation" in df_crypto.columns:
-                        colonnes_base.insert(2, "type_operation")
-
-                    df_display = df_crypto[colonnes_base].copy()
-
-                    # Formatage de base d'abord
-                    df_display["montant"] = df_display["montant"].apply(
-                        lambda x: f"{x:,.2f}€".replace(",", " ")
-                    )
-                    df_display["prix_unitaire"] = df_display["prix_unitaire"].apply(
-                        lambda x: f"{x:,.2f}€".replace(",", " ")
+                    # Créer les données de vente
+                    donnees_vente = business_logic.creer_donnees_vente(
+                        date_bourse.isoformat(),
+                        symbole_bourse,
+                        montant_bourse,
+                        prix_unitaire_bourse,
                     )
-                    df_display["quantite"] = df_display["quantite"].apply(lambda x: f"{x:.8f}")
-
-                    # Ajouter les colonnes de performance si disponibles
-                    styled_df = df_display  # Par défaut, pas de style
-                    if (
-                        "prix_actuel" in df_crypto.columns
-                        and "pnl_montant" in df_crypto.columns
-                        and "pnl_pourcentage" in df_crypto.columns
-                    ):
-                        df_display["prix_actuel"] = df_crypto["prix_actuel"].apply(
-                            lambda x: f"{x:,.2f}€".replace(",", " ") if x is not None else "N/A"
-                        )
-                        df_display["valeur_actuelle"] = df_crypto["valeur_actuelle"].apply(
-                            lambda x: f"{x:,.2f}€".replace(",", " ")
-                        )
-                        df_display["pnl_montant"] = df_crypto["pnl_montant"].apply(
-                            lambda x: f"{x:+,.2f}€".replace(",", " ")
-                        )
-                        df_display["pnl_pourcentage"] = df_crypto["pnl_pourcentage"].apply(
-                            lambda x: f"{x:+.1f}%"
-                        )
-
-                        # Renommer les colonnes d'abord
-                        if "type_operation" in df_crypto.columns:
-                            df_display.columns = [
-                                "Date",
-                                "Symbole",
-                                "Type",
-                                "Quantité",
-                                "Prix Achat",
-                                "Investi",
-                                "Prix Actuel",
-                                "Valeur Actuelle",
-                                "P&L €",
-                                "P&L %",
-                            ]
-                        else:
-                            df_display.columns = [
-                                "Date",
-                                "Symbole",
-                                "Quantité",
-                                "Prix Achat",
-                                "Investi",
-                                "Prix Actuel",
-                                "Valeur Actuelle",
-                                "P&L €",
-                                "P&L %",
-                            ]
-
-                        # Appliquer un style conditionnel pour les P&L
-                        def color_pnl(val):
-                            if "+" in str(val):
-                                return "color: green"
-                            elif "-" in str(val):
-                                return "color: red"
-                            return ""
-
-                        # Appliquer le style maintenant que toutes les colonnes sont formatées
-                        styled_df = df_display.style.map(color_pnl, subset=["P&L €", "P&L %"])
-                        st.dataframe(styled_df, use_container_width=True)
-                    else:
-                        if "type_operation" in df_crypto.columns:
-                            df_display.columns = [
-                                "Date",
-                                "Symbole",
-                                "Type",
-                                "Quantité",
-                                "Prix Achat",
-                                "Investi",
-                            ]
-                        else:
-                            df_display.columns = [
-                                "Date",
-                                "Symbole",
-                                "Quantité",
-                                "Prix Achat",
-                                "Investi",
-                            ]
-                        st.dataframe(df_display, use_container_width=True)
-                        st.warning("Impossible de récupérer les prix actuels")
 
-            else:
-                st.info("Aucun investissement crypto enregistré")
+                    try:
+                        supabase.table("bourse").insert(donnees_vente).execute()
+                        invalidate_data()
 
-        # Section Deep Dive - en dehors des colonnes pour être centrée
-        if data["crypto"]:
-            st.markdown("---")
-
-            # Section Deep Dive
-            st.subheader("📊 Deep Dive")
-
-            # Récupérer les symboles uniques
-            symboles_uniques_crypto = sorted(list(set([inv["symbole"] for inv in data["crypto"]])))
-
-            # Récupérer la sélection précédente si elle existe
-            default_index_crypto = None
-            if "crypto_deep_dive_symbol" in st.session_state:
-                previous_symbol_crypto = st.session_state.crypto_deep_dive_symbol
-                if previous_symbol_crypto in symboles_uniques_crypto:
-                    default_index_crypto = symboles_uniques_crypto.index(previous_symbol_crypto)
-
-            symbole_selected_crypto = st.selectbox(
-                "Sélectionner une crypto pour analyse détaillée",
-                options=symboles_uniques_crypto,
-                index=default_index_crypto,
-                placeholder="-- Choisir une crypto --",
-                key="crypto_deep_dive_select",
-            )
+                        # Vider tous les caches de performance qui pourraient être corrompus
+                        # (une vente change le PnL réalisé FIFO : résumé à recalculer)
+                        clear_perf_cache()
+                        st.session_state.pop("portfolio_summary", None)
 
-            # Sauvegarder la sélection dans session_state
-            if symbole_selected_crypto:
-                st.session_state.crypto_deep_dive_symbol = symbole_selected_crypto
+                        st.toast("Vente bourse ajoutée!")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Erreur lors de l'ajout de la vente bourse: {e}")
+            else:
+                # Validation standard pour les achats
+                erreurs = business_logic.valider_donnees_investissement(
+                    montant_bourse, prix_unitaire_bourse, symbole_bourse
+                )
 
-            if symbole_selected_crypto:
-                # Récupérer les données de performance si disponibles
-                crypto_cache_key = f"crypto_perf_{len(data['crypto'])}"
-                crypto_with_perf = st.session_state.get(crypto_cache_key)
+                if erreurs:
+                    for erreur in erreurs:
+                        st.error(erreur)
+                else:
+                    # Créer les données d'investissement standard
+                    donnees_investissement = business_logic.creer_donnees_investissement(
+                        date_bourse.isoformat(),
+                        symbole_bourse,
+                        montant_bourse,
+                        prix_unitaire_bourse,
+                        hors_budget_bourse,
+                    )
+                    # Ajouter le type d'opération
+                    donnees_investissement["type_operation"] = type_operation_bourse
 
-                # Filtrer les investissements pour ce symbole
-                investissements_symbole_crypto = [
-                    inv for inv in data["crypto"] if inv["symbole"] == symbole_selected_crypto
-                ]
+                    try:
+                        resultat = supabase.table("bourse").insert(donnees_investissement).execute()
+                        invalidate_data()
 
-                if crypto_with_perf:
-                    perf_symbole_crypto = [
-                        inv for inv in crypto_with_perf if inv["symbole"] == symbole_selected_crypto
-                    ]
-                else:
-                    perf_symbole_crypto = investissements_symbole_crypto
+                        # Lignes rechargées pour la clé des performances : le rerun
+                        # qui suit les relit depuis le cache, sans nouvel aller-retour
+                        data = load_data()
 
-                # Calculer les statistiques
-                # Quantité réelle disponible (achats - ventes)
-                quantite_disponible_crypto = business_logic.calculer_quantite_disponible(
-                    data["crypto"], symbole_selected_crypto
-                )
+                        # Mettre à jour les performances avec la seule nouvelle ligne
+                        if resultat.data:
+                            add_to_performance_cache(
+                                "bourse", bourse_cache_key, data["bourse"], resultat.data[0]
+                            )
+                        st.toast("Investissement bourse ajouté!")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Erreur lors de l'ajout de l'investissement bourse: {e}")
+
+
+@st.fragment
+def _render_crypto_form(data, crypto_cache_key, existing_symbols_crypto):
+    """Formulaire d'ajout d'un achat ou d'une vente crypto, avec sa file d'attente
+
+    Exécuté comme fragment, comme le formulaire bourse : les saisies et la mise en attente
+    ne relancent que le formulaire. Un ajout ou un lot enregistré relance toute la page.
+
+    Args:
+        data: Données chargées (dict de listes par table)
+        crypto_cache_key: Clé du cache de performances crypto (voir get_perf_cache)
+        existing_symbols_crypto: Liste triée des symboles crypto
+    """
+    st.subheader("Nouvel investissement")
+
+    # Saisie du symbole avec liste déroulante
+    if existing_symbols_crypto:
+        # Utiliser un selectbox avec les symboles existants + option "Autre"
+        crypto_options = existing_symbols_crypto + ["🆕 Autre symbole..."]
+        symbole_choice_crypto = st.selectbox(
+            "Symbole",
+            options=crypto_options,
+            index=None,
+            placeholder="-- Choisir un symbole --",
+            help="Choisissez un symbole existant ou 'Autre symbole...' " "pour saisir manuellement",
+            key="crypto_symbole_select",
+        )
 
-                # Calculs séparés pour achats et ventes
-                achats_symbole_crypto = [
-                    inv
-                    for inv in investissements_symbole_crypto
-                    if inv.get("type_operation") != "Vente"
-                ]
-                ventes_symbole_crypto = [
-                    inv
-                    for inv in investissements_symbole_crypto
-                    if inv.get("type_operation") == "Vente"
-                ]
+        if symbole_choice_crypto == "🆕 Autre symbole...":
+            symbole_crypto = st.text_input(
+                "Nouveau symbole crypto",
+                placeholder="Ex: BTC, ETH, ADA...",
+                help="Tapez le nom ou symbole de la crypto",
+                key="crypto_symbole_input",
+                label_visibility="collapsed",
+            )
+        elif symbole_choice_crypto is not None:
+            symbole_crypto = symbole_choice_crypto
+        else:
+            symbole_crypto = ""
+    else:
+        # Si aucun symbole existant, saisie directe
+        symbole_crypto = st.text_input(
+            "Symbole",
+            placeholder="Ex: BTC, ETH, ADA...",
+            help="Tapez le nom ou symbole de la crypto",
+            key="crypto_symbole_input",
+        )
+    hors_budget_crypto = st.checkbox(
+        "Hors budget (conversion/existant)",
+        help="Cochez si c'est un investissement existant "
+        "ou une conversion qui ne doit pas être déduit du budget",
+        key="crypto_hors_budget",
+    )
 
-                # Total investi = somme des achats seulement
-                # (les ventes ne comptent pas comme investissement)
-                total_investi_symbole_crypto = sum(
-                    [inv["montant"] for inv in achats_symbole_crypto]
-                )
+    # Type d'opération
+    type_operation_crypto = st.selectbox(
+        "Type d'opération",
+        options=["Achat", "Vente", "RoundUP", "SaveBack"],
+        index=0,
+        help="Sélectionnez le type d'opération (achat, vente, roundup, ou saveback)",
+        key="crypto_type_operation",
+    )
 
-                # Prix moyen d'achat basé sur les achats uniquement
-                prix_moyen_achat_crypto = (
-                    total_investi_symbole_crypto
-                    / sum([inv["quantite"] for inv in achats_symbole_crypto])
-                    if achats_symbole_crypto
-                    else 0
-                )
+    montant_crypto = st.number_input(
+        "Montant (€)",
+        min_value=0.0,
+        value=None,
+        step=10.0,
+        key="crypto_montant",
+        help="Saisissez le montant de votre investissement",
+    )
+    date_crypto = st.date_input("Date d'achat", key="crypto_date")
+    prix_unitaire_crypto = st.number_input(
+        "Prix unitaire (€)", min_value=0.0, value=None, step=0.01, key="crypto_prix"
+    )
 
-                # PnL réalisé via FIFO
-                pnl_realise_data_crypto = st.session_state.price_service.calculate_realized_pnl(
-                    data["crypto"], symbole_selected_crypto
+    col_ajout_crypto, col_attente_crypto = st.columns(2)
+    with col_ajout_crypto:
+        ajouter_crypto = st.button("Ajouter Investissement Crypto")
+    with col_attente_crypto:
+        attente_crypto = st.button(
+            "Mettre en attente",
+            key="crypto_mettre_en_attente",
+            help="Empile l'opération pour l'enregistrer en lot avec les suivantes",
+        )
+    file_crypto = st.session_state.get("pending_crypto", [])
+
+    if ajouter_crypto or attente_crypto:
+        if symbole_crypto and (montant_crypto or 0) > 0 and (prix_unitaire_crypto or 0) > 0:
+
+            if type_operation_crypto == "Vente":
+                # Validation spécifique pour les ventes
+                quantite_vente = montant_crypto / prix_unitaire_crypto
+                erreurs = business_logic.valider_donnees_vente(
+                    montant_crypto,
+                    prix_unitaire_crypto,
+                    symbole_crypto,
+                    quantite_vente,
+                    data["crypto"] + file_crypto,
                 )
 
-                # Performance globale du titre
-                if perf_symbole_crypto and any(
-                    inv.get("valeur_actuelle") for inv in perf_symbole_crypto
-                ):
-                    # Valeur actuelle = somme des valeurs actuelles
-                    # des achats seulement (ventes = 0)
-                    perf_achats_crypto = [
-                        inv for inv in perf_symbole_crypto if inv.get("type_operation") != "Vente"
-                    ]
-                    valeur_actuelle_symbole_crypto = sum(
-                        [inv.get("valeur_actuelle", inv["montant"]) for inv in perf_achats_crypto]
+                if erreurs:
+                    for erreur in erreurs:
+                        st.error(erreur)
+                else:
+                    # Créer les données de vente
+                    donnees_vente = business_logic.creer_donnees_vente(
+                        date_crypto.isoformat(),
+                        symbole_crypto,
+                        montant_crypto,
+                        prix_unitaire_crypto,
                     )
 
-                    # PnL non réalisé (différence valeur actuelle vs investissement)
-                    pnl_non_realise_crypto = (
-                        valeur_actuelle_symbole_crypto - total_investi_symbole_crypto
-                    )
+                    if attente_crypto:
+                        mettre_en_attente("crypto", donnees_vente)
+                        st.success("Vente crypto mise en attente")
+                    else:
+                        try:
+                            supabase.table("crypto").insert(donnees_vente).execute()
+                            invalidate_data()
+
+                            # Vider les caches de performance (potentiellement corrompus) :
+                            # une vente change le PnL réalisé FIFO, résumé à recalculer
+                            clear_perf_cache()
+                            st.session_state.pop("portfolio_summary", None)
+
+                            st.toast("Vente crypto ajoutée!")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Erreur lors de l'ajout de la vente crypto: {e}")
+            else:
+                # Validation standard pour les achats
+                erreurs = business_logic.valider_donnees_investissement(
+                    montant_crypto, prix_unitaire_crypto, symbole_crypto
+                )
 
-                    # PnL total = réalisé + non réalisé
-                    pnl_symbole_crypto = (
-                        pnl_realise_data_crypto["pnl_realise_montant"] + pnl_non_realise_crypto
-                    )
-                    pnl_pct_symbole_crypto = (
-                        (pnl_symbole_crypto / total_investi_symbole_crypto * 100)
-                        if total_investi_symbole_crypto > 0
-                        else 0
+                if erreurs:
+                    for erreur in erreurs:
+                        st.error(erreur)
+                else:
+                    # Créer les données d'investissement standard
+                    donnees_investissement = business_logic.creer_donnees_investissement(
+                        date_crypto.isoformat(),
+                        symbole_crypto,
+                        montant_crypto,
+                        prix_unitaire_crypto,
+                        hors_budget_crypto,
                     )
+                    # Ajouter le type d'opération
+                    donnees_investissement["type_operation"] = type_operation_crypto
 
-                    # Première ligne : Métriques principales
-                    col1, col2, col3, col4 = st.columns(4)
+                    if attente_crypto:
+                        mettre_en_attente("crypto", donnees_investissement)
+                        st.success("Investissement crypto mis en attente")
+                    else:
+                        try:
+                            resultat = (
+                                supabase.table("crypto").insert(donnees_investissement).execute()
+                            )
+                            invalidate_data()
+
+                            # Lignes rechargées pour la clé des performances : le rerun
+                            # qui suit les relit depuis le cache, sans nouvel aller-retour
+                            data = load_data()
+
+                            # Mettre à jour les performances avec la seule nouvelle ligne
+                            if resultat.data:
+                                add_to_performance_cache(
+                                    "crypto",
+                                    crypto_cache_key,
+                                    data["crypto"],
+                                    resultat.data[0],
+                                )
+                            st.toast("Investissement crypto ajouté!")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Erreur lors de l'ajout de l'investissement crypto: {e}")
+
+    # Opérations en attente : un seul insert pour tout le lot
+    file_crypto = st.session_state.get("pending_crypto", [])
+    if file_crypto:
+        st.info(f"{len(file_crypto)} opération(s) crypto en attente")
+        col_lot_crypto, col_vider_crypto = st.columns(2)
+        with col_lot_crypto:
+            enregistrer_lot_crypto = st.button(
+                f"Enregistrer {len(file_crypto)} opération(s)", key="crypto_enregistrer_lot"
+            )
+        with col_vider_crypto:
+            if st.button("Vider la file", key="crypto_vider_file"):
+                st.session_state.pop("pending_crypto", None)
+                st.rerun()
 
-                    with col1:
-                        st.metric(
-                            "Total investi",
-                            f"{total_investi_symbole_crypto:,.2f}€".replace(",", " "),
-                        )
+        if enregistrer_lot_crypto:
+            try:
+                supabase.table("crypto").insert(file_crypto).execute()
+                st.session_state.pop("pending_crypto", None)
+                invalidate_data()
 
-                    with col2:
-                        st.metric(
-                            "Valeur actuelle",
-                            f"{valeur_actuelle_symbole_crypto:,.2f}€".replace(",", " "),
-                        )
+                # Le lot peut contenir des ventes : performances et résumé à recalculer
+                clear_perf_cache()
+                st.session_state.pop("portfolio_summary", None)
 
-                    with col3:
-                        st.metric("P&L %", "", delta=f"{pnl_pct_symbole_crypto:+.1f}%")
+                st.toast(f"{len(file_crypto)} opération(s) crypto enregistrée(s)!")
+                st.rerun()
+            except Exception as e:
+                st.error(f"Erreur lors de l'enregistrement du lot crypto: {e}")
 
-                    with col4:
-                        st.metric(
-                            "P&L €", "", delta=f"{pnl_symbole_crypto:+,.2f}€".replace(",", " ")
-                        )
 
-                    # Affichage détaillé du PnL si il y a des ventes
-                    if ventes_symbole_crypto:
-                        st.markdown("#### 💰 Analyse PnL Réalisé vs Non Réalisé")
+def main():
+    st.title("Tracker d'Investissements")
+    st.markdown("---")
 
-                        # Première ligne : PnL
-                        col1, col2, col3, col4 = st.columns(4)
+    data = load_data()
+    # Sauvegarde locale après une insertion, hors du chemin de l'insertion
+    save_data_in_background(data)
+    # Les listes servent à la logique métier, les DataFrames aux agrégats et filtres
+    frames = load_frames()
+    df_revenus_data = frames["revenus"]
+    df_bourse_data = frames["bourse"]
+    df_crypto_data = frames["crypto"]
+
+    # Clés des performances en session, recalculées à chaque changement de contenu
+    perf_cache_keys = {
+        asset_type: perf_cache_key(asset_type, data[asset_type])
+        for asset_type in ("bourse", "crypto")
+    }
+    bourse_cache_key = perf_cache_keys["bourse"]
+    crypto_cache_key = perf_cache_keys["crypto"]
+
+    # Index des périodes déjà saisies, pour un test d'existence en O(1)
+    periodes_existantes = set(df_revenus_data["periode"])
+
+    # Service de prix partagé (st.cache_resource)
+    price_service = get_price_service()
 
-                        with col1:
-                            pnl_realise_crypto = pnl_realise_data_crypto["pnl_realise_montant"]
-                            st.metric(
-                                "PnL Réalisé €", f"{pnl_realise_crypto:+,.2f}€".replace(",", " ")
-                            )
+    # Sidebar pour saisie des revenus
+    with st.sidebar:
+        _render_revenu_form(periodes_existantes)
 
-                        with col2:
-                            pnl_realise_pct_crypto = pnl_realise_data_crypto[
-                                "pnl_realise_pourcentage"
-                            ]
-                            st.metric("PnL Réalisé %", f"{pnl_realise_pct_crypto:+.1f}%")
+    # Symboles calculés une seule fois, partagés par les formulaires et les Deep Dive
+    try:
+        existing_symbols = _existing_symbols_cached(data_version())
+    except Exception:
+        existing_symbols = {"bourse": [], "crypto": []}
+    existing_symbols_bourse = existing_symbols["bourse"]
+    existing_symbols_crypto = existing_symbols["crypto"]
+
+    # Calcul des budgets d'investissement séparés (sommes exactes en centimes, arrondies à
+    # l'euro supérieur : la règle vit dans business_logic, testée)
+    budget_bourse, budget_crypto, budget_total = business_logic.calculer_budget_disponible(
+        data["revenus"]
+    )
 
-                        with col3:
-                            st.metric(
-                                "PnL Non Réalisé €",
-                                f"{pnl_non_realise_crypto:+,.2f}€".replace(",", " "),
-                            )
+    # hors_budget est un booléen (None des anciennes lignes déjà converti en False)
+    budget_utilise_bourse = df_bourse_data.loc[~df_bourse_data["hors_budget"], "montant"].sum()
+    budget_utilise_crypto = df_crypto_data.loc[~df_crypto_data["hors_budget"], "montant"].sum()
 
-                        with col4:
-                            quantite_vendue_crypto = pnl_realise_data_crypto[
-                                "quantite_vendue_totale"
-                            ]
-                            st.metric("Quantité Vendue", f"{quantite_vendue_crypto:.8f}")
+    # Total réellement investi (incluant hors budget)
+    total_investi_bourse = df_bourse_data["montant"].sum()
+    total_investi_crypto = df_crypto_data["montant"].sum()
 
-                        # Deuxième ligne : Prix moyens
-                        col1, col2, col3, col4 = st.columns(4)
+    budget_restant_bourse = budget_bourse - budget_utilise_bourse
+    budget_restant_crypto = budget_crypto - budget_utilise_crypto
 
-                        with col1:
-                            prix_moyen_vente_crypto = pnl_realise_data_crypto["prix_moyen_vente"]
-                            st.metric(
-                                "Prix Moyen Vente",
-                                f"{prix_moyen_vente_crypto:,.2f}€".replace(",", " "),
-                            )
+    # Métriques globales avec performances en temps réel
+    total_investi_reel = total_investi_bourse + total_investi_crypto
+    total_restant = budget_restant_bourse + budget_restant_crypto
 
-                        with col2:
-                            prix_moyen_achat_vendu_crypto = pnl_realise_data_crypto[
-                                "prix_moyen_achat_vendu"
-                            ]
-                            st.metric(
-                                "Prix Moyen Achat Vendu",
-                                f"{prix_moyen_achat_vendu_crypto:,.2f}€".replace(",", " "),
-                            )
+    # Calculer les performances globales au chargement si nécessaire
+    portfolio_summary = get_portfolio_summary(perf_cache_keys)
 
-                        with col3:
-                            # Différence de prix
-                            diff_prix_crypto = (
-                                prix_moyen_vente_crypto - prix_moyen_achat_vendu_crypto
-                            )
-                            st.metric(
-                                "Différence Prix", f"{diff_prix_crypto:+,.2f}€".replace(",", " ")
-                            )
+    # Ne calculer que si on n'a pas de résumé ET qu'on n'est pas en train de
+    # gérer des choix de symboles
+    should_calculate_performance = (
+        not portfolio_summary
+        and (data["bourse"] or data["crypto"])
+        and not hasattr(st.session_state, "symbol_choices")
+        and not hasattr(st.session_state, "pending_symbol")
+    )
 
-                        with col4:
-                            # Espace libre pour futur usage
-                            st.metric("", "")
-
-                        # Tableau détaillé des positions restantes
-                        st.markdown("#### 📋 Détail des Positions" " par Ligne d'Achat (FIFO)")
-                        # SOLUTION: Récupérer directement les données depuis
-                        # Supabase pour éviter les corruptions
-                        raw_data_crypto = (
-                            supabase.table("crypto")
-                            .select("*")
-                            .eq("symbole", symbole_selected_crypto.upper())
-                            .execute()
-                            .data
-                        )
+    if should_calculate_performance:
+        # Calculer sans spinner pour éviter les rerun intempestifs ; les performances par
+        # type sont mises en cache pour les onglets, qui ne les recalculent pas
+        portfolio_summary = compute_portfolio_performances(data, perf_cache_keys)
 
-                        positions_restantes_crypto = (
-                            business_logic.calculer_positions_restantes_fifo(
-                                raw_data_crypto, symbole_selected_crypto
-                            )
+    # Bouton pour actualiser les prix - affiché seulement après le calcul
+    # des performances OU s'il n'y a pas d'investissements
+    if portfolio_summary or not (data["bourse"] or data["crypto"]):
+        col_refresh, col_empty = st.columns([1, 5])
+        with col_refresh:
+            if st.button("🔄 Actualiser les prix"):
+                price_service.clear_cache()
+                # Seuls les prix changent : les performances en cache sont mises à jour
+                # sur place, sans recharger les données ni relancer le script
+                perf_par_type = {}
+                for asset_type in ("bourse", "crypto"):
+                    cache_key = perf_cache_keys[asset_type]
+                    perf_en_cache = get_perf_cache(cache_key)
+                    if perf_en_cache is not None:
+                        perf_par_type[asset_type] = price_service.refresh_prices_inplace(
+                            perf_en_cache, asset_type
                         )
-
-                        if positions_restantes_crypto:
-                            # Préparer les données pour le tableau
-                            tableau_positions_crypto = []
-                            for pos in positions_restantes_crypto:
-                                date_obj = datetime.strptime(pos["date"], "%Y-%m-%d")
-                                tableau_positions_crypto.append(
-                                    {
-                                        "Date": date_obj.strftime("%d/%m/%Y"),
-                                        "Type": pos["type_operation"],
-                                        "Prix €": f"{pos['prix_unitaire']:,.2f}".replace(",", " "),
-                                        "Quantité Initiale": f"{pos['quantite_initiale']:.8f}",
-                                        "Quantité Restante": f"{pos['quantite_restante']:.8f}",
-                                        "Valeur Restante €": (
-                                            f"{pos['montant_restant']:,.2f}".replace(",", " ")
-                                        ),
-                                        "% Vendu": (
-                                            f"{((pos['quantite_initiale']
-                                                 - pos['quantite_restante'])
-                                                / pos['quantite_initiale'] * 100):.1f}%"
-                                            if pos["quantite_initiale"] > 0
-                                            else "0%"
-                                        ),
-                                    }
-                                )
-
-                            df_positions_crypto = pd.DataFrame(tableau_positions_crypto)
-                            st.dataframe(
-                                df_positions_crypto, use_container_width=True, hide_index=True
-                            )
-
-                            # Résumé
-                            total_initial_crypto = sum(
-                                [pos["montant_initial"] for pos in positions_restantes_crypto]
-                            )
-                            total_restant_crypto = sum(
-                                [pos["montant_restant"] for pos in positions_restantes_crypto]
-                            )
-                            total_vendu_crypto = total_initial_crypto
-                            -total_restant_crypto
-                            st.info(
-                                f"📈 **Résumé :** {total_vendu_crypto:,.2f}€ vendu"
-                                f" sur {total_initial_crypto:,.2f}€ initiaux"
-                                f" ({total_vendu_crypto / total_initial_crypto * 100:.1f}"
-                                f"% du portefeuille initial)".replace(",", " ")
-                            )
-
-                # Deuxième ligne : Les métriques de détail
-                col1, col2, col3 = st.columns(3)
-
-                with col1:
-                    if perf_symbole_crypto and any(
-                        inv.get("prix_actuel") for inv in perf_symbole_crypto
-                    ):
-                        prix_actuel_crypto = next(
-                            (
-                                inv["prix_actuel"]
-                                for inv in perf_symbole_crypto
-                                if inv.get("prix_actuel")
-                            ),
-                            0,
+                    elif data[asset_type]:
+                        perf_par_type[asset_type] = price_service.calculate_investment_performance(
+                            data[asset_type], asset_type
                         )
-                        st.metric("Prix actuel", f"{prix_actuel_crypto:,.2f}€".replace(",", " "))
+                        set_perf_cache(cache_key, perf_par_type[asset_type])
                     else:
-                        st.metric("Prix actuel", "N/A")
-
-                with col2:
-                    st.metric(
-                        "Prix moyen d'achat", f"{prix_moyen_achat_crypto:,.2f}€".replace(",", " ")
-                    )
+                        perf_par_type[asset_type] = []
 
-                with col3:
-                    st.metric("Quantité disponible", f"{quantite_disponible_crypto:.8f}")
+                portfolio_summary = price_service.calculate_portfolio_summary(
+                    perf_par_type["crypto"], perf_par_type["bourse"]
+                )
+                set_portfolio_summary(perf_cache_keys, portfolio_summary)
 
-                # Graphique d'évolution du prix avec points d'achat
-                st.subheader(f"📈 Évolution du prix - {symbole_selected_crypto}")
+    # Tabs pour Bourse et Crypto
+    tab_revenus, tab_bourse, tab_crypto, tab_overview = st.tabs(
+        ["Revenus", "Bourse", "Crypto", "Vue d'ensemble"]
+    )
 
-                # Créer le graphique seulement si on a des données de prix
-                if perf_symbole_crypto and any(
-                    inv.get("prix_actuel") for inv in perf_symbole_crypto
-                ):
+    with tab_bourse:
+        st.header("Investissements Bourse")
 
-                    # Préparer les données pour le graphique
-                    dates_achat_crypto = [
-                        datetime.strptime(inv["date"], "%Y-%m-%d")
-                        for inv in investissements_symbole_crypto
-                    ]
-                    prix_achat_crypto = [
-                        inv["prix_unitaire"] for inv in investissements_symbole_crypto
-                    ]
-                    montants_achat_crypto = [
-                        inv["montant"] for inv in investissements_symbole_crypto
-                    ]
-                    types_operation_crypto = [
-                        inv.get("type_operation", "Achat") for inv in investissements_symbole_crypto
-                    ]
+        # Métriques spécifiques bourse
+        col_m1, col_m2, col_m3, col_m4, col_m5 = st.columns(5)
+        with col_m1:
+            st.metric("Budget Bourse", eur(budget_bourse, 0))
+        with col_m2:
+            st.metric("Investi Bourse", eur(total_investi_bourse))
+        with col_m3:
+            st.metric("Restant Bourse", eur(budget_restant_bourse))
+        with col_m4:
+            # Calculer la valeur actuelle à partir des données individuelles si disponibles
+            bourse_with_perf = get_perf_cache(bourse_cache_key)
 
-                    # Prix actuel (on prend le premier disponible)
-                    prix_actuel_crypto = next(
-                        (
-                            inv["prix_actuel"]
-                            for inv in perf_symbole_crypto
-                            if inv.get("prix_actuel")
-                        ),
-                        0,
-                    )
+            if bourse_with_perf and any(inv.get("valeur_actuelle") for inv in bourse_with_perf):
+                valeur_actuelle_bourse = np.fromiter(
+                    (inv["valeur_actuelle"] for inv in bourse_with_perf),
+                    dtype=np.float64,
+                    count=len(bourse_with_perf),
+                ).sum()
+                st.metric("Valeur Actuelle", eur(valeur_actuelle_bourse))
+            elif portfolio_summary and portfolio_summary["bourse"]["valeur_actuelle"] > 0:
+                valeur_actuelle_bourse = portfolio_summary["bourse"]["valeur_actuelle"]
+                st.metric("Valeur Actuelle", eur(valeur_actuelle_bourse))
+            else:
+                st.metric("Valeur Actuelle", eur(total_investi_bourse))
+        with col_m5:
+            # Calculer le P&L à partir des données individuelles si disponibles
+            # (pnl_montant est toujours numérique en sortie de calculate_investment_performance)
+            if bourse_with_perf:
+                pnl_bourse = np.fromiter(
+                    (inv["pnl_montant"] for inv in bourse_with_perf),
+                    dtype=np.float64,
+                    count=len(bourse_with_perf),
+                ).sum()
+                pnl_pct_bourse = (
+                    (pnl_bourse / total_investi_bourse * 100) if total_investi_bourse > 0 else 0
+                )
+                st.metric(
+                    "P&L Total",
+                    eur_signe(pnl_bourse),
+                    delta=f"{pnl_pct_bourse:+.1f}%",
+                )
+            elif portfolio_summary and portfolio_summary["bourse"]["pnl_montant"] is not None:
+                pnl_bourse = portfolio_summary["bourse"]["pnl_montant"]
+                pnl_pct_bourse = portfolio_summary["bourse"]["pnl_pourcentage"]
+                st.metric(
+                    "P&L Total",
+                    eur_signe(pnl_bourse),
+                    delta=f"{pnl_pct_bourse:+.1f}%",
+                )
+            else:
+                st.metric("P&L Total", "0€", delta="0.0%")
 
-                    fig_crypto = go.Figure()
+        st.markdown("---")
 
-                    # Ligne horizontale pour le prix actuel
-                    fig_crypto.add_hline(
-                        y=prix_actuel_crypto,
-                        line_dash="dash",
-                        line_color="blue",
-                        annotation_text=f"Prix actuel: {prix_actuel_crypto:,.2f}€".replace(
-                            ",", " "
-                        ),
-                        annotation_position="bottom right",
-                    )
+        col1, col2 = st.columns([1, 2])
 
-                    # Séparer les données par type d'opération
-                    types_uniques_crypto = list(set(types_operation_crypto))
-                    colors_crypto = {
-                        "Achat": "#22C55E",
-                        "RoundUP": "#22C55E",
-                        "SaveBack": "#22C55E",
-                        "Vente": "#EF4444",
-                    }
-                    shapes_crypto = {
-                        "Achat": "circle",
-                        "RoundUP": "diamond",
-                        "SaveBack": "square",
-                        "Vente": "triangle-down",
-                    }
+        with col1:
+            _render_bourse_form(data, bourse_cache_key, existing_symbols_bourse)
 
-                    for type_op in types_uniques_crypto:
-                        # Filtrer les données pour ce type d'opération
-                        indices = [i for i, t in enumerate(types_operation_crypto) if t == type_op]
-                        dates_type = [dates_achat_crypto[i] for i in indices]
-                        prix_type = [prix_achat_crypto[i] for i in indices]
-                        montants_type = [montants_achat_crypto[i] for i in indices]
-
-                        color = colors_crypto.get(type_op, "#FF6B35")
-                        shape = shapes_crypto.get(type_op, "circle")
-
-                        # Préparer les hover texts - TEMPORAIREMENT COMMENTÉ
-                        # hover_texts_crypto = []
-                        # for date, prix, montant in zip(dates_type, prix_type, montants_type):
-                        #     base_text = f"Date:
-                        #     {date.strftime('%d/%m/%Y')}<br>Type: {type_op}
-                        #     <br>Prix: {prix:,.2f}€<br>Montant: {montant:,.2f}
-                        #     €".replace(",", " ")
-                        #
-                        #     if type_op == "Vente":
-                        #         # Pour les ventes, ajouter le PnL réalisé
-                        #         pnl_realise_data_crypto =
-                        #         st.session_state.price_service.calculate_realized_pnl(
-                        #             data["crypto"], symbole_selected_crypto
-                        #         )
-                        #         base_text += f"<br>PnL réalisé:
-                        #         {pnl_realise_data_crypto['pnl_realise_montant']
-                        #         :+,.2f}€".replace(",", " ")
-                        #
-                        #     hover_texts_crypto.append(base_text)
-
-                        # Version simplifiée temporaire
-                        hover_texts_crypto = [
-                            (
-                                f"Date: {date.strftime('%d/%m/%Y')}"
-                                f"<br>Type: {type_op}<br>Prix: {prix:,.2f}€"
-                                f"<br>Montant: {montant:,.2f}€"
-                            ).replace(",", " ")
-                            for date, prix, montant in zip(dates_type, prix_type, montants_type)
-                        ]
+        with col2:
+            if data["bourse"]:
+                st.subheader("Portfolio Bourse")
 
-                        fig_crypto.add_trace(
-                            go.Scatter(
-                                x=dates_type,
-                                y=prix_type,
-                                mode="markers",
-                                marker=dict(
-                                    size=7.5,
-                                    color=color,
-                                    symbol=shape,
-                                    line=dict(width=2, color=color),
-                                ),
-                                name=type_op,
-                                text=hover_texts_crypto,
-                                hovertemplate="%{text}<extra></extra>",
-                            )
+                # Calculer les performances avec prix actuels seulement si nécessaire
+                bourse_with_perf = get_perf_cache(bourse_cache_key)
+                if bourse_with_perf is None:
+                    with st.spinner("Récupération des prix actuels..."):
+                        bourse_with_perf = price_service.calculate_investment_performance(
+                            data["bourse"], "bourse"
                         )
+                        set_perf_cache(bourse_cache_key, bourse_with_perf)
 
-                    # Ligne du prix moyen d'achat (uniquement si on a des achats)
-                    if prix_moyen_achat_crypto > 0:
-                        fig_crypto.add_hline(
-                            y=prix_moyen_achat_crypto,
-                            line_dash="dot",
-                            line_color="green",
-                            annotation_text=(
-                                f"Prix moyen d'achat:" f" {prix_moyen_achat_crypto:,.2f}€"
-                            ).replace(",", " "),
-                            annotation_position="top right",
+                if bourse_with_perf:
+                    # Tableau trié et daté mis en cache : seul le style est refait au rerun
+                    df_display = build_portfolio_display(bourse_with_perf)
+                    formats = portfolio_formats(df_display.columns, "{:.4f}".format)
+
+                    if "P&L €" in df_display.columns:
+                        # Appliquer un style conditionnel pour les P&L, colonne par colonne
+                        styled_df = df_display.style.format(formats, na_rep="N/A").apply(
+                            style_pnl, subset=["P&L €", "P&L %"]
                         )
+                        st.dataframe(styled_df, use_container_width=True)
+                    else:
+                        st.dataframe(df_display.style.format(formats), use_container_width=True)
+                        st.warning("Impossible de récupérer les prix actuels")
 
-                    fig_crypto.update_layout(
-                        title=f"Évolution des prix d'achat - {symbole_selected_crypto}",
-                        xaxis_title="Date",
-                        yaxis_title="Prix (€)",
-                        hovermode="closest",
-                        showlegend=True,
-                        height=400,
-                    )
+            else:
+                st.info("Aucun investissement bourse enregistré")
 
-                    st.plotly_chart(fig_crypto, use_container_width=True)
-                else:
-                    st.info("Graphique non disponible - prix actuels non récupérés")
+        # Section Deep Dive - en dehors des colonnes pour être centrée
+        _render_symbole_panel(data, df_bourse_data, bourse_cache_key, existing_symbols_bourse)
 
-                # Tableau détaillé des transactions
-                st.subheader(f"Historique des transactions - {symbole_selected_crypto}")
+    with tab_crypto:
+        st.header("Investissements Crypto")
 
-                df_symbole_crypto = pd.DataFrame(perf_symbole_crypto)
-                # Trier par date AVANT la conversion en format d'affichage
-                df_symbole_crypto["date"] = pd.to_datetime(df_symbole_crypto["date"])
-                df_symbole_crypto = df_symbole_crypto.sort_values(
-                    "date", ascending=False
-                )  # Plus récent en premier
-                df_symbole_crypto["date"] = df_symbole_crypto["date"].dt.strftime("%d/%m/%Y")
+        # Métriques spécifiques crypto
+        col_m1, col_m2, col_m3, col_m4, col_m5 = st.columns(5)
+        with col_m1:
+            st.metric("Budget Crypto", eur(budget_crypto, 0))
+        with col_m2:
+            st.metric("Investi Crypto", eur(total_investi_crypto))
+        with col_m3:
+            st.metric("Restant Crypto", eur(budget_restant_crypto))
+        with col_m4:
+            # Calculer la valeur actuelle à partir des données individuelles si disponibles
+            crypto_with_perf = get_perf_cache(crypto_cache_key)
 
-                # Préparer les colonnes d'affichage
-                colonnes_base_crypto = ["date", "quantite", "prix_unitaire", "montant"]
+            if crypto_with_perf and any(inv.get("valeur_actuelle") for inv in crypto_with_perf):
+                valeur_actuelle_crypto = np.fromiter(
+                    (inv["valeur_actuelle"] for inv in crypto_with_perf),
+                    dtype=np.float64,
+                    count=len(crypto_with_perf),
+                ).sum()
+                st.metric("Valeur Actuelle", eur(valeur_actuelle_crypto))
+            elif portfolio_summary and portfolio_summary["crypto"]["valeur_actuelle"] > 0:
+                valeur_actuelle_crypto = portfolio_summary["crypto"]["valeur_actuelle"]
+                st.metric("Valeur Actuelle", eur(valeur_actuelle_crypto))
+            else:
+                st.metric("Valeur Actuelle", eur(total_investi_crypto))
+        with col_m5:
+            # Calculer le P&L à partir des données individuelles si disponibles
+            # (pnl_montant est toujours numérique en sortie de calculate_investment_performance)
+            if crypto_with_perf:
+                pnl_crypto = np.fromiter(
+                    (inv["pnl_montant"] for inv in crypto_with_perf),
+                    dtype=np.float64,
+                    count=len(crypto_with_perf),
+                ).sum()
+                pnl_pct_crypto = (
+                    (pnl_crypto / total_investi_crypto * 100) if total_investi_crypto > 0 else 0
+                )
+                st.metric(
+                    "P&L Total",
+                    eur_signe(pnl_crypto),
+                    delta=f"{pnl_pct_crypto:+.1f}%",
+                )
+            elif portfolio_summary and portfolio_summary["crypto"]["pnl_montant"] is not None:
+                pnl_crypto = portfolio_summary["crypto"]["pnl_montant"]
+                pnl_pct_crypto = portfolio_summary["crypto"]["pnl_pourcentage"]
+                st.metric(
+                    "P&L Total",
+                    eur_signe(pnl_crypto),
+                    delta=f"{pnl_pct_crypto:+.1f}%",
+                )
+            else:
+                st.metric("P&L Total", "0€", delta="0.0%")
 
-                # Ajouter type_operation si disponible
-                if "type_operation" in df_symbole_crypto.columns:
-                    colonnes_base_crypto.insert(1, "type_operation")
+        st.markdown("---")
 
-                df_display_symbole_crypto = df_symbole_crypto[colonnes_base_crypto].copy()
+        col1, col2 = st.columns([1, 2])
 
-                # Formatage
-                df_display_symbole_crypto["montant"] = df_display_symbole_crypto["montant"].apply(
-                    lambda x: f"{x:,.2f}€".replace(",", " ")
-                )
-                df_display_symbole_crypto["prix_unitaire"] = df_display_symbole_crypto[
-                    "prix_unitaire"
-                ].apply(lambda x: f"{x:,.2f}€".replace(",", " "))
-                df_display_symbole_crypto["quantite"] = df_display_symbole_crypto["quantite"].apply(
-                    lambda x: f"{x:.8f}"
-                )
+        with col1:
+            _render_crypto_form(data, crypto_cache_key, existing_symbols_crypto)
 
-                # Ajouter les colonnes de performance si disponibles
-                if (
-                    "prix_actuel" in df_symbole_crypto.columns
-                    and "pnl_montant" in df_symbole_crypto.columns
-                    and "pnl_pourcentage" in df_symbole_crypto.columns
-                ):
-                    df_display_symbole_crypto["prix_actuel"] = df_symbole_crypto[
-                        "prix_actuel"
-                    ].apply(lambda x: f"{x:,.2f}€".replace(",", " ") if x is not None else "N/A")
-                    df_display_symbole_crypto["valeur_actuelle"] = df_symbole_crypto[
-                        "valeur_actuelle"
-                    ].apply(lambda x: f"{x:,.2f}€".replace(",", " "))
-                    df_display_symbole_crypto["pnl_montant"] = df_symbole_crypto[
-                        "pnl_montant"
-                    ].apply(lambda x: f"{x:+,.2f}€".replace(",", " "))
-                    df_display_symbole_crypto["pnl_pourcentage"] = df_symbole_crypto[
-                        "pnl_pourcentage"
-                    ].apply(lambda x: f"{x:+.1f}%")
-
-                    # Renommer les colonnes
-                    if "type_operation" in df_symbole_crypto.columns:
-                        df_display_symbole_crypto.columns = [
-                            "Date",
-                            "Type",
-                            "Quantité",
-                            "Prix Achat",
-                            "Investi",
-                            "Prix Actuel",
-                            "Valeur Actuelle",
-                            "P&L €",
-                            "P&L %",
-                        ]
-                    else:
-                        df_display_symbole_crypto.columns = [
-                            "Date",
-                            "Quantité",
-                            "Prix Achat",
-                            "Investi",
-                            "Prix Actuel",
-                            "Valeur Actuelle",
-                            "P&L €",
-                            "P&L %",
-                        ]
+        with col2:
+            if data["crypto"]:
+                st.subheader("Portfolio Crypto")
 
-                    # Appliquer le style conditionnel
-                    def color_pnl_crypto(val):
-                        if "+" in str(val):
-                            return "color: green"
-                        elif "-" in str(val):
-                            return "color: red"
-                        return ""
+                # Calculer les performances avec prix actuels seulement si nécessaire
+                crypto_with_perf = get_perf_cache(crypto_cache_key)
+                if crypto_with_perf is None:
+                    with st.spinner("Récupération des prix crypto actuels..."):
+                        crypto_with_perf = price_service.calculate_investment_performance(
+                            data["crypto"], "crypto"
+                        )
+                        set_perf_cache(crypto_cache_key, crypto_with_perf)
 
-                    styled_df_symbole_crypto = df_display_symbole_crypto.style.map(
-                        color_pnl_crypto, subset=["P&L €", "P&L %"]
-                    )
-                    st.dataframe(styled_df_symbole_crypto, use_container_width=True)
-                else:
-                    if "type_operation" in df_symbole_crypto.columns:
-                        df_display_symbole_crypto.columns = [
-                            "Date",
-                            "Type",
-                            "Quantité",
-                            "Prix Achat",
-                            "Investi",
-                        ]
+                if crypto_with_perf:
+                    # Même tableau que la bourse : colonnes numériques, formatées au rendu
+                    df_display = build_portfolio_display(crypto_with_perf)
+                    formats = portfolio_formats(df_display.columns, "{:.8f}".format)
+
+                    if "P&L €" in df_display.columns:
+                        styled_df = df_display.style.format(formats, na_rep="N/A").apply(
+                            style_pnl, subset=["P&L €", "P&L %"]
+                        )
+                        st.dataframe(styled_df, use_container_width=True)
                     else:
-                        df_display_symbole_crypto.columns = [
-                            "Date",
-                            "Quantité",
-                            "Prix Achat",
-                            "Investi",
-                        ]
-                    st.dataframe(df_display_symbole_crypto, use_container_width=True)
+                        st.dataframe(df_display.style.format(formats), use_container_width=True)
+                        st.warning("Impossible de récupérer les prix actuels")
+
+            else:
+                st.info("Aucun investissement crypto enregistré")
+
+        # Section Deep Dive - en dehors des colonnes pour être centrée
+        _render_crypto_panel(data, df_crypto_data, crypto_cache_key, existing_symbols_crypto)
 
     with tab_revenus:
         st.header("Historique des Revenus")
 
-        if data["revenus"]:
-            df_revenus = pd.DataFrame(data["revenus"])
-
-            # Conversion du mois en nom
-            noms_mois = [
-                "Janvier",
-                "Février",
-                "Mars",
-                "Avril",
-                "Mai",
-                "Juin",
-                "Juillet",
-                "Août",
-                "Septembre",
-                "Octobre",
-                "Novembre",
-                "Décembre",
-            ]
-            df_revenus["mois_nom"] = df_revenus["mois"].apply(lambda x: noms_mois[x - 1])
+        if not df_revenus_data.empty:
+            # Déjà triés par année et mois par Postgres. Copie superficielle : seule une
+            # colonne est ajoutée, les données ne sont pas modifiées
+            df_revenus = df_revenus_data.copy(deep=False)
 
-            # Tri par année et mois
-            df_revenus = df_revenus.sort_values(["annee", "mois"])
+            # Conversion du mois en nom : codes 0-11 d'une catégorie, sans appel Python par ligne
+            df_revenus["mois_nom"] = pd.Categorical.from_codes(
+                df_revenus["mois"].to_numpy() - 1, categories=MOIS_NOMS
+            )
 
             # Affichage du tableau
             st.subheader("Récapitulatif des revenus")
 
             # Affichage du tableau
             df_display = df_revenus[["annee", "mois_nom", "montant"]].copy()
-            df_display["budget_total"] = (
-                (
-                    df_revenus["investissement_disponible_bourse"]
-                    + df_revenus["investissement_disponible_crypto"]
-                )
-                .round()
-                .astype(int)
-            )
+            # Un seul calcul NumPy (somme, arrondi, entier) sur les buffers des colonnes
+            df_display["budget_total"] = np.rint(
+                df_revenus["investissement_disponible_bourse"].to_numpy()
+                + df_revenus["investissement_disponible_crypto"].to_numpy()
+            ).astype(np.int64)
             df_display.columns = ["Année", "Mois", "Revenu Net (€)", "Budget Investissement (€)"]
             st.dataframe(df_display, use_container_width=True)
 
@@ -1992,15 +2132,13 @@ def main():
 
             with col1:
                 total_revenus = df_revenus["montant"].sum()
-                st.metric("Total des Revenus", f"{total_revenus:,.2f}€".replace(",", " "))
+                st.metric("Total des Revenus", eur(total_revenus))
 
             with col2:
                 total_investissement_bourse = df_revenus["investissement_disponible_bourse"].sum()
                 total_investissement_crypto = df_revenus["investissement_disponible_crypto"].sum()
                 total_investissement = total_investissement_bourse + total_investissement_crypto
-                st.metric(
-                    "Total Budget Investissement", f"{total_investissement:,.2f}€".replace(",", " ")
-                )
+                st.metric("Total Budget Investissement", eur(total_investissement))
 
             with col3:
                 nb_mois = len(df_revenus)
@@ -2012,31 +2150,12 @@ def main():
     with tab_overview:
         st.header("Vue d'ensemble")
 
-        # Calculer les performances globales ici seulement si nécessaire
+        # Sans résumé (calcul différé en haut de page pendant un choix de symbole), le calcul
+        # se fait à la demande : les reruns des autres onglets ne refont pas l'appel aux prix
         if not portfolio_summary and (data["bourse"] or data["crypto"]):
-            with st.spinner("Calcul des performances globales..."):
-                crypto_with_perf = (
-                    st.session_state.price_service.calculate_investment_performance(
-                        data["crypto"], "crypto"
-                    )
-                    if data["crypto"]
-                    else []
-                )
-
-                bourse_with_perf = (
-                    st.session_state.price_service.calculate_investment_performance(
-                        data["bourse"], "bourse"
-                    )
-                    if data["bourse"]
-                    else []
-                )
-
-                portfolio_summary = st.session_state.price_service.calculate_portfolio_summary(
-                    crypto_with_perf, bourse_with_perf
-                )
-
-                # Mettre en cache dans la session
-                st.session_state.portfolio_summary = portfolio_summary
+            if st.button("Calculer les performances", key="calc_perf"):
+                with st.spinner("Calcul des performances globales..."):
+                    portfolio_summary = compute_portfolio_performances(data, perf_cache_keys)
 
         if data["bourse"] or data["crypto"]:
             # Section Performances
@@ -2047,15 +2166,15 @@ def main():
 
                 with col1:
                     total_investi = portfolio_summary["total"]["valeur_initiale"]
-                    st.metric("Total Investi", f"{total_investi:,.2f}€".replace(",", " "))
+                    st.metric("Total Investi", eur(total_investi))
 
                 with col2:
                     valeur_actuelle = portfolio_summary["total"]["valeur_actuelle"]
-                    st.metric("Valeur Actuelle", f"{valeur_actuelle:,.2f}€".replace(",", " "))
+                    st.metric("Valeur Actuelle", eur(valeur_actuelle))
 
                 with col3:
                     pnl_montant = portfolio_summary["total"]["pnl_montant"]
-                    st.metric("P&L €", f"{pnl_montant:+,.2f}€".replace(",", " "))
+                    st.metric("P&L €", eur_signe(pnl_montant))
 
                 with col4:
                     pnl_pct = portfolio_summary["total"]["pnl_pourcentage"]
@@ -2,7 +2,6 @@
 Logique métier de l'application d'investissement
 """
 
-import math
 from typing import Dict, List, Tuple
 
 
@@ -75,11 +74,12 @@ def calculer_budget_disponible(revenus: List[Dict]) -> Tuple[int, int, int]:
     Returns:
         Tuple (budget_bourse, budget_crypto, budget_total)
     """
-    budget_bourse_brut = sum([r["investissement_disponible_bourse"] for r in revenus])
-    budget_crypto_brut = sum([r["investissement_disponible_crypto"] for r in revenus])
+    # Sommes en centimes entiers (exactes), arrondies à l'euro supérieur
+    centimes_bourse = sum(round(r["investissement_disponible_bourse"] * 100) for r in revenus)
+    centimes_crypto = sum(round(r["investissement_disponible_crypto"] * 100) for r in revenus)
 
-    budget_bourse = math.ceil(budget_bourse_brut)
-    budget_crypto = math.ceil(budget_crypto_brut)
+    budget_bourse = -(-centimes_bourse // 100)
+    budget_crypto = -(-centimes_crypto // 100)
     budget_total = budget_bourse + budget_crypto
 
     return budget_bourse, budget_crypto, budget_total
@@ -95,8 +95,8 @@ def calculer_budget_utilise(investissements: List[Dict]) -> Tuple[float, float]:
     Returns:
         Tuple (budget_utilise, total_investi)
     """
-    budget_utilise = sum([i["montant"] for i in investissements if not i.get("hors_budget", False)])
-    total_investi = sum([i["montant"] for i in investissements])
+    budget_utilise = sum(i["montant"] for i in investissements if not i.get("hors_budget", False))
+    total_investi = sum(i["montant"] for i in investissements)
 
     return budget_utilise, total_investi
 
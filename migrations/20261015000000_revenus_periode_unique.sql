@@ -0,0 +1,4 @@
+-- Un seul revenu par période (format YYYY-MM).
+-- Permet à l'application d'insérer via upsert(on_conflict="periode", ignore_duplicates=True)
+-- et de laisser Postgres rejeter les doublons au lieu de les rechercher côté Python.
+ALTER TABLE revenus ADD CONSTRAINT revenus_periode_key UNIQUE (periode);
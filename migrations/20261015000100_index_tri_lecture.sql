@@ -0,0 +1,5 @@
+-- Index couvrant l'ordre de lecture de l'application (TABLE_ORDER dans app.py) :
+-- Postgres renvoie les lignes triées par un parcours d'index, sans tri en mémoire.
+CREATE INDEX IF NOT EXISTS revenus_annee_mois_idx ON revenus (annee, mois);
+CREATE INDEX IF NOT EXISTS bourse_date_id_idx ON bourse (date, id);
+CREATE INDEX IF NOT EXISTS crypto_date_id_idx ON crypto (date, id);
@@ -3,6 +3,7 @@ Service pour récupérer les prix en temps réel et calculer les performances
 """
 
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
@@ -187,6 +188,71 @@ class PriceService:
         else:
             return None
 
+    def fetch_prices_bulk(
+        self, symbols: List[str], asset_type: str, show_log: bool = True
+    ) -> Dict[str, Optional[float]]:
+        """
+        Récupère les prix de plusieurs symboles avec un seul appel Yahoo Finance
+
+        Les symboles ayant un mapping appris sont téléchargés ensemble ; les autres
+        (ou ceux sans cours) passent par get_current_price.
+
+        Args:
+            symbols: Symboles utilisateur à valoriser
+            asset_type: Type d'actif ('crypto' ou 'bourse')
+            show_log: Afficher ou non les logs (par défaut True)
+
+        Returns:
+            Dict symbole -> prix actuel en EUR (None si introuvable)
+        """
+        cache_prefix = "crypto" if asset_type.lower() == "crypto" else "stock"
+        prices = {}
+
+        # Prix encore valides en cache
+        for symbol in symbols:
+            if self._is_cache_valid(f"{cache_prefix}_{symbol}"):
+                prices[symbol] = self.cache[f"{cache_prefix}_{symbol}"]["price"]
+
+        # Un seul aller-retour Supabase pour les mappings, un seul pour Yahoo
+        missing = [symbol for symbol in symbols if symbol not in prices]
+        mappings = self._get_learned_mappings(missing) if missing else {}
+        if mappings:
+            try:
+                yahoo_symbols = sorted(set(mappings.values()))
+                closes = yf.download(yahoo_symbols, period="2d", progress=False)["Close"]
+                if closes.ndim == 1:
+                    # Un seul ticker avec yfinance < 0.2.48 : colonnes à un seul niveau,
+                    # "Close" est alors une Series et non une colonne par ticker
+                    closes = closes.to_frame(yahoo_symbols[0])
+                for symbol, yahoo_symbol in mappings.items():
+                    if yahoo_symbol not in closes:
+                        continue
+                    history = closes[yahoo_symbol].dropna()
+                    if not history.empty:
+                        price = float(history.iloc[-1])
+                        self.cache[f"{cache_prefix}_{symbol}"] = {
+                            "price": price,
+                            "timestamp": time.time(),
+                        }
+                        prices[symbol] = price
+                if show_log:
+                    print(f"Prix récupérés en lot: {len(prices)}/{len(symbols)} symboles")
+            except Exception as e:
+                if show_log:
+                    print(f"Erreur lors de la récupération groupée des prix: {e}")
+
+        # Repli symbole par symbole (variantes de place de cotation, etc.) : chaque repli
+        # enchaîne des appels réseau bloquants, les symboles sont donc traités en parallèle
+        fallback = [symbol for symbol in symbols if symbol not in prices]
+        if fallback:
+            with ThreadPoolExecutor(max_workers=min(8, len(fallback))) as executor:
+                fallback_prices = executor.map(
+                    lambda symbol: self.get_current_price(symbol, asset_type, show_log), fallback
+                )
+                prices.update(zip(fallback, fallback_prices))
+
+        return prices
+
     def calculate_investment_performance(
         self, investments: List[Dict], asset_type: str
     ) -> List[Dict]:
@@ -200,86 +266,126 @@ class PriceService:
         Returns:
             Liste des investissements avec données de performance
         """
-        enriched_investments = []
-
         # Récupérer les symboles uniques pour éviter les appels API redondants
-        unique_symbols = list(set([inv["symbole"] for inv in investments]))
-
-        # Récupérer les prix une seule fois par symbole
-        symbol_prices = {}
-        for symbol in unique_symbols:
-            symbol_prices[symbol] = self.get_current_price(symbol, asset_type, show_log=True)
-
-        for investment in investments:
-            enriched_investment = investment.copy()
-
-            symbol = investment["symbole"]
-            current_price = symbol_prices[symbol]
-            is_sale = investment.get("type_operation") == "Vente"
-
-            if current_price is not None:
-                transaction_price = investment["prix_unitaire"]
-                quantity = investment["quantite"]
-                initial_value = investment["montant"]
-
-                if is_sale:
-                    # Pour les ventes : valeur actuelle = 0 (on n'a plus l'actif)
-                    # PnL = prix de vente vs prix d'achat moyen (calculé plus tard via FIFO)
-                    current_value = 0.0
-
-                    # PnL temporaire basé sur le prix actuel vs prix de vente
-                    # (Le PnL réalisé final sera calculé via FIFO dans calculate_realized_pnl)
-                    pnl_amount = 0.0  # Sera calculé plus tard
-                    pnl_percentage = 0.0  # Sera calculé plus tard
-
-                    enriched_investment.update(
-                        {
-                            "prix_actuel": current_price,
-                            "valeur_actuelle": current_value,
-                            "pnl_montant": pnl_amount,
-                            "pnl_pourcentage": pnl_percentage,
-                            "prix_recupere": True,
-                        }
-                    )
-                else:
-                    # Pour les achats : calcul normal (comme avant)
-                    current_value = quantity * current_price
-
-                    # Plus-value/moins-value en valeur absolue
-                    pnl_amount = current_value - initial_value
-
-                    # Plus-value/moins-value en pourcentage
-                    pnl_percentage = ((current_price - transaction_price) / transaction_price) * 100
-
-                    enriched_investment.update(
-                        {
-                            "prix_actuel": current_price,
-                            "valeur_actuelle": current_value,
-                            "pnl_montant": pnl_amount,
-                            "pnl_pourcentage": pnl_percentage,
-                            "prix_recupere": True,
-                        }
-                    )
+        unique_symbols = list(dict.fromkeys(inv["symbole"] for inv in investments))
+
+        # Récupérer les prix une seule fois par symbole, en lot
+        symbol_prices = self.fetch_prices_bulk(unique_symbols, asset_type)
+
+        return [
+            self._enrich_investment(investment, symbol_prices[investment["symbole"]])
+            for investment in investments
+        ]
+
+    def _enrich_investment(self, investment: Dict, current_price: Optional[float]) -> Dict:
+        """
+        Ajoute les données de performance à un investissement (achat ou vente)
+
+        Args:
+            investment: Investissement à enrichir
+            current_price: Prix actuel de l'actif (None si non récupéré)
+
+        Returns:
+            Copie de l'investissement avec les données de performance
+            ("valeur_actuelle" et "pnl_montant" sont toujours numériques, même sans prix)
+        """
+        enriched_investment = investment.copy()
+        is_sale = investment.get("type_operation") == "Vente"
+
+        if current_price is not None:
+            transaction_price = investment["prix_unitaire"]
+            quantity = investment["quantite"]
+            initial_value = investment["montant"]
+
+            if is_sale:
+                # Pour les ventes : valeur actuelle = 0 (on n'a plus l'actif)
+                # PnL = prix de vente vs prix d'achat moyen (calculé plus tard via FIFO)
+                current_value = 0.0
+
+                # PnL temporaire basé sur le prix actuel vs prix de vente
+                # (Le PnL réalisé final sera calculé via FIFO dans calculate_realized_pnl)
+                pnl_amount = 0.0  # Sera calculé plus tard
+                pnl_percentage = 0.0  # Sera calculé plus tard
+
+                enriched_investment.update(
+                    {
+                        "prix_actuel": current_price,
+                        "valeur_actuelle": current_value,
+                        "pnl_montant": pnl_amount,
+                        "pnl_pourcentage": pnl_percentage,
+                        "prix_recupere": True,
+                    }
+                )
             else:
-                # Prix non récupéré
-                if is_sale:
-                    current_value = 0.0
-                else:
-                    current_value = investment["montant"]
+                # Pour les achats : calcul normal (comme avant)
+                current_value = quantity * current_price
+
+                # Plus-value/moins-value en valeur absolue
+                pnl_amount = current_value - initial_value
+
+                # Plus-value/moins-value en pourcentage
+                pnl_percentage = ((current_price - transaction_price) / transaction_price) * 100
 
                 enriched_investment.update(
                     {
-                        "prix_actuel": None,
+                        "prix_actuel": current_price,
                         "valeur_actuelle": current_value,
-                        "pnl_montant": 0,
-                        "pnl_pourcentage": 0,
-                        "prix_recupere": False,
+                        "pnl_montant": pnl_amount,
+                        "pnl_pourcentage": pnl_percentage,
+                        "prix_recupere": True,
                     }
                 )
+        else:
+            # Prix non récupéré
+            if is_sale:
+                current_value = 0.0
+            else:
+                current_value = investment["montant"]
 
-            enriched_investments.append(enriched_investment)
+            enriched_investment.update(
+                {
+                    "prix_actuel": None,
+                    "valeur_actuelle": current_value,
+                    "pnl_montant": 0,
+                    "pnl_pourcentage": 0,
+                    "prix_recupere": False,
+                }
+            )
+
+        return enriched_investment
 
-        return enriched_investments
+    def refresh_prices_inplace(self, items: List[Dict], asset_type: str) -> List[Dict]:
+        """
+        Met à jour les champs de prix et de performance d'investissements déjà enrichis,
+        sans recréer les lignes
+
+        Args:
+            items: Investissements issus de calculate_investment_performance (modifiés en place)
+            asset_type: Type d'actif ('crypto' ou 'bourse')
+
+        Returns:
+            La même liste, avec les prix actuels rafraîchis
+        """
+        symbol_prices = self.fetch_prices_bulk(
+            list({item["symbole"] for item in items}), asset_type
+        )
+        for item in items:
+            item.update(self._enrich_investment(item, symbol_prices[item["symbole"]]))
+        return items
+
+    def calculate_investment_performance_single(self, investment: Dict, asset_type: str) -> Dict:
+        """
+        Calcule la performance d'un seul investissement (un seul appel de prix)
+
+        Args:
+            investment: Investissement à évaluer
+            asset_type: Type d'actif ('crypto' ou 'bourse')
+
+        Returns:
+            Investissement avec données de performance
+        """
+        current_price = self.get_current_price(investment["symbole"], asset_type, show_log=True)
+        return self._enrich_investment(investment, current_price)
 
     def calculate_realized_pnl(self, investments: List[Dict], symbol: str) -> Dict:
         """
@@ -313,47 +419,19 @@ class PriceService:
                 "prix_moyen_achat_vendu": 0.0,
             }
 
-        # Calcul FIFO
-        import copy
-
-        remaining_purchases = copy.deepcopy(purchases)  # Queue des achats restants
-        total_pnl_realized = 0.0
+        # Calcul FIFO sur des listes de flottants, sans copier les achats
+        total_pnl_realized, total_cost_basis = self._match_fifo(
+            [p["quantite"] for p in purchases],
+            [p["prix_unitaire"] for p in purchases],
+            [s["quantite"] for s in sales],
+            [s["prix_unitaire"] for s in sales],
+        )
         total_quantity_sold = 0.0
         total_sale_value = 0.0
-        total_cost_basis = 0.0
-
         for sale in sales:
-            sale_quantity = sale["quantite"]
-            sale_price = sale["prix_unitaire"]
-            quantity_to_match = sale_quantity
-
-            total_quantity_sold += sale_quantity
+            total_quantity_sold += sale["quantite"]
             total_sale_value += sale["montant"]
 
-            # Associer cette vente aux achats FIFO
-            while quantity_to_match > 0 and remaining_purchases:
-                purchase = remaining_purchases[0]
-                available_qty = purchase["quantite"]
-                purchase_price = purchase["prix_unitaire"]
-
-                if available_qty <= quantity_to_match:
-                    # Consommer tout cet achat
-                    matched_qty = available_qty
-                    remaining_purchases.pop(0)  # Retirer cet achat
-                else:
-                    # Consommer partiellement cet achat
-                    matched_qty = quantity_to_match
-                    purchase["quantite"] -= matched_qty  # Réduire la quantité restante
-
-                # Calculer le PnL pour cette portion
-                cost_basis = matched_qty * purchase_price
-                sale_value = matched_qty * sale_price
-                portion_pnl = sale_value - cost_basis
-
-                total_pnl_realized += portion_pnl
-                total_cost_basis += cost_basis
-                quantity_to_match -= matched_qty
-
         # Calculs finaux
         avg_sale_price = total_sale_value / total_quantity_sold if total_quantity_sold > 0 else 0.0
         avg_purchase_price = (
@@ -371,6 +449,57 @@ class PriceService:
             "prix_moyen_achat_vendu": avg_purchase_price,
         }
 
+    @staticmethod
+    def _match_fifo(
+        purchase_quantities: List[float],
+        purchase_prices: List[float],
+        sale_quantities: List[float],
+        sale_prices: List[float],
+    ) -> Tuple[float, float]:
+        """
+        Associe les ventes aux achats les plus anciens (FIFO) en un seul passage
+
+        Args:
+            purchase_quantities: Quantités des achats, triés par date
+            purchase_prices: Prix unitaires des achats
+            sale_quantities: Quantités des ventes, triées par date
+            sale_prices: Prix unitaires des ventes
+
+        Returns:
+            Tuple (pnl_realise, cout_d_achat_des_quantites_vendues)
+        """
+        total_pnl_realized = 0.0
+        total_cost_basis = 0.0
+
+        # Index de l'achat en tête de file et quantité qu'il lui reste
+        index = 0
+        available_qty = purchase_quantities[0] if purchase_quantities else 0.0
+
+        for sale_quantity, sale_price in zip(sale_quantities, sale_prices):
+            quantity_to_match = sale_quantity
+
+            while quantity_to_match > 0 and index < len(purchase_quantities):
+                purchase_price = purchase_prices[index]
+
+                if available_qty <= quantity_to_match:
+                    # Consommer tout cet achat et passer au suivant
+                    matched_qty = available_qty
+                    index += 1
+                    if index < len(purchase_quantities):
+                        available_qty = purchase_quantities[index]
+                else:
+                    # Consommer partiellement cet achat
+                    matched_qty = quantity_to_match
+                    available_qty -= matched_qty
+
+                # Calculer le PnL pour cette portion
+                cost_basis = matched_qty * purchase_price
+                total_pnl_realized += matched_qty * sale_price - cost_basis
+                total_cost_basis += cost_basis
+                quantity_to_match -= matched_qty
+
+        return total_pnl_realized, total_cost_basis
+
     def calculate_portfolio_summary(
         self, crypto_investments: List[Dict], stock_investments: List[Dict]
     ) -> Dict:
@@ -401,20 +530,24 @@ class PriceService:
             purchases = [inv for inv in investments if inv.get("type_operation") != "Vente"]
 
             # Valeur initiale = somme des achats seulement
-            initial_value = sum([inv["montant"] for inv in purchases])
+            initial_value = sum(inv["montant"] for inv in purchases)
 
             # Valeur actuelle = somme des valeurs actuelles (achats seulement, ventes = 0)
-            current_value = sum([inv["valeur_actuelle"] for inv in purchases])
+            current_value = sum(inv["valeur_actuelle"] for inv in purchases)
 
             # PnL non réalisé = différence valeur actuelle vs investissement initial
             unrealized_pnl = current_value - initial_value
 
-            # PnL réalisé = calculer pour tous les symboles uniques
-            unique_symbols = list(set([inv["symbole"] for inv in investments]))
+            # PnL réalisé = calculer pour tous les symboles uniques. Les lignes sont
+            # regroupées par symbole en un seul passage : chaque calcul FIFO ne parcourt
+            # que les lignes de son symbole, au lieu de refiltrer toute la liste
+            investments_by_symbol = {}
+            for inv in investments:
+                investments_by_symbol.setdefault(inv["symbole"].upper(), []).append(inv)
             realized_pnl_total = 0.0
 
-            for symbol in unique_symbols:
-                realized_data = self.calculate_realized_pnl(investments, symbol)
+            for symbol, symbol_investments in investments_by_symbol.items():
+                realized_data = self.calculate_realized_pnl(symbol_investments, symbol)
                 realized_pnl_total += realized_data["pnl_realise_montant"]
 
             # PnL total = réalisé + non réalisé
@@ -457,6 +590,60 @@ class PriceService:
             },
         }
 
+    def merge_into_summary(
+        self,
+        summary: Dict,
+        investment: Dict,
+        asset_type: str,
+        investments: Optional[List[Dict]] = None,
+    ) -> Dict:
+        """
+        Intègre un nouvel achat (déjà enrichi) dans un résumé de portfolio existant,
+        sans recalculer les autres lignes
+
+        Args:
+            summary: Résumé retourné par calculate_portfolio_summary (modifié en place)
+            investment: Achat avec données de performance
+            asset_type: Type d'actif ('crypto' ou 'bourse')
+            investments: Investissements du même type déjà saisis, pour détecter un achat
+                antidaté
+
+        Returns:
+            Le résumé mis à jour
+
+        Raises:
+            ValueError: Si l'opération modifie le PnL réalisé (recalcul complet nécessaire)
+        """
+        if investment.get("type_operation") == "Vente":
+            # Une vente modifie le PnL réalisé FIFO de tout le symbole
+            raise ValueError("Une vente nécessite un recalcul complet du résumé")
+
+        symbol = investment["symbole"].upper()
+        if any(
+            inv.get("type_operation") == "Vente"
+            and inv["symbole"].upper() == symbol
+            and inv["date"] >= investment["date"]
+            for inv in investments or []
+        ):
+            # Achat antidaté avant une vente du symbole : il change les lots consommés FIFO
+            raise ValueError("Un achat antérieur à une vente nécessite un recalcul complet")
+
+        initial_value = investment["montant"]
+        current_value = investment["valeur_actuelle"]
+
+        for metrics in (summary[asset_type], summary["total"]):
+            metrics["valeur_initiale"] += initial_value
+            metrics["valeur_actuelle"] += current_value
+            metrics["pnl_non_realise"] += current_value - initial_value
+            metrics["pnl_montant"] = metrics["pnl_realise"] + metrics["pnl_non_realise"]
+            metrics["pnl_pourcentage"] = (
+                (metrics["pnl_montant"] / metrics["valeur_initiale"] * 100)
+                if metrics["valeur_initiale"] > 0
+                else 0
+            )
+
+        return summary
+
     def _get_learned_mapping(self, symbol: str) -> Optional[str]:
         """Récupère un mapping appris depuis Supabase"""
         if not self.supabase:
@@ -475,6 +662,28 @@ class PriceService:
             print(f"Erreur lors de la récupération du mapping pour {symbol}: {e}")
         return None
 
+    def _get_learned_mappings(self, symbols: List[str]) -> Dict[str, str]:
+        """Récupère en une requête les mappings appris pour plusieurs symboles"""
+        if not self.supabase:
+            return {}
+
+        try:
+            result = (
+                self.supabase.table("symbol_mappings")
+                .select("user_symbol,yahoo_symbol")
+                .in_("user_symbol", [symbol.upper() for symbol in symbols])
+                .execute()
+            )
+            yahoo_symbols = {row["user_symbol"]: row["yahoo_symbol"] for row in result.data}
+            return {
+                symbol: yahoo_symbols[symbol.upper()]
+                for symbol in symbols
+                if symbol.upper() in yahoo_symbols
+            }
+        except Exception as e:
+            print(f"Erreur lors de la récupération des mappings: {e}")
+        return {}
+
     def _save_learned_mapping(self, user_symbol: str, yahoo_symbol: str, company_name: str = None):
         """Sauvegarde un mapping appris dans Supabase"""
         if not self.supabase:
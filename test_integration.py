@@ -10,8 +10,11 @@ Ce test simule un workflow complet sans utiliser Supabase.
 
 from unittest.mock import Mock, patch
 
+import pandas as pd
+import pytest
 
 from business_logic import (
+    calculer_budget_disponible,
     calculer_positions_restantes_fifo,
     calculer_quantite_disponible,
     creer_donnees_investissement,
@@ -308,6 +311,240 @@ class TestIntegration:
 
         print("SUCCESS Test intégration performance réussi !")
 
+    def test_mise_a_jour_incrementale_resume(self):
+        """Test de l'ajout d'un achat au résumé sans recalcul complet"""
+        print("\n=== TEST MISE A JOUR INCREMENTALE ===")
+
+        investments = [creer_donnees_investissement("2024-01-01", "AAPL", 1000.0, 100.0, False)]
+        nouvel_achat = creer_donnees_investissement("2024-02-01", "AAPL", 500.0, 125.0, False)
+
+        with patch.object(self.price_service, "get_current_price", self.mock_get_current_price):
+            perf_investments = self.price_service.calculate_investment_performance(
+                investments, "bourse"
+            )
+            summary = self.price_service.calculate_portfolio_summary([], perf_investments)
+
+            enrichi = self.price_service.calculate_investment_performance_single(
+                nouvel_achat, "bourse"
+            )
+            self.price_service.merge_into_summary(summary, enrichi, "bourse")
+
+            # Le résumé incrémental doit correspondre à un recalcul complet
+            complet = self.price_service.calculate_portfolio_summary(
+                [],
+                self.price_service.calculate_investment_performance(
+                    investments + [nouvel_achat], "bourse"
+                ),
+            )
+
+        print(f"OK Résumé incrémental - PnL: {summary['total']['pnl_montant']}€")
+        for cle in ("valeur_initiale", "valeur_actuelle", "pnl_montant", "pnl_pourcentage"):
+            assert summary["bourse"][cle] == complet["bourse"][cle]
+            assert summary["total"][cle] == complet["total"][cle]
+
+        # Achat antidaté avant une vente du symbole : la vente consomme d'autres lots FIFO,
+        # le PnL réalisé change et le résumé doit être recalculé en entier
+        investments = [
+            creer_donnees_investissement("2024-01-01", "AAPL", 1000.0, 100.0, False),
+            creer_donnees_vente("2024-03-01", "AAPL", 1500.0, 150.0),
+        ]
+        achat_antidate = creer_donnees_investissement("2023-12-01", "AAPL", 500.0, 50.0, False)
+
+        with patch.object(self.price_service, "get_current_price", self.mock_get_current_price):
+            summary = self.price_service.calculate_portfolio_summary(
+                [], self.price_service.calculate_investment_performance(investments, "bourse")
+            )
+            enrichi = self.price_service.calculate_investment_performance_single(
+                achat_antidate, "bourse"
+            )
+            complet = self.price_service.calculate_portfolio_summary(
+                [],
+                self.price_service.calculate_investment_performance(
+                    investments + [achat_antidate], "bourse"
+                ),
+            )
+
+        pnl_realise_avant = summary["bourse"]["pnl_realise"]
+        with pytest.raises(ValueError):
+            self.price_service.merge_into_summary(summary, enrichi, "bourse", investments)
+        # Le résumé n'est pas modifié quand la fusion est refusée
+        assert summary["bourse"]["pnl_realise"] == pnl_realise_avant == 500.0
+        assert complet["bourse"]["pnl_realise"] == 1000.0  # (150-50)*10
+
+        print("SUCCESS Test mise à jour incrémentale réussi !")
+
+    def test_actualisation_prix_sur_place(self):
+        """Test de l'actualisation des prix d'une liste de performances en cache"""
+        print("\n=== TEST ACTUALISATION PRIX SUR PLACE ===")
+
+        investments = [
+            creer_donnees_investissement("2024-01-01", "AAPL", 1500.0, 150.0, False),
+            creer_donnees_investissement("2024-02-01", "AAPL", 1000.0, 100.0, False),
+            creer_donnees_investissement("2024-01-01", "MSFT", 2000.0, 200.0, False),
+            creer_donnees_vente("2024-03-01", "MSFT", 1250.0, 250.0),
+        ]
+        prix = {"AAPL": 150.0, "MSFT": 250.0}
+
+        def mock_prices(symbol, asset_type, show_log=True):
+            return prix.get(symbol)
+
+        champs_prix = {"prix_actuel", "valeur_actuelle", "pnl_montant", "pnl_pourcentage"}
+
+        with patch.object(self.price_service, "get_current_price", mock_prices):
+            perf_en_cache = self.price_service.calculate_investment_performance(
+                investments, "bourse"
+            )
+            lignes = list(perf_en_cache)
+            avant = [dict(ligne) for ligne in perf_en_cache]
+
+            prix.update({"AAPL": 200.0, "MSFT": 300.0})
+            self.price_service.clear_cache()
+            actualise = self.price_service.refresh_prices_inplace(perf_en_cache, "bourse")
+
+            # Même liste et mêmes lignes, modifiées sur place
+            assert actualise is perf_en_cache
+            assert all(ligne is avant_ligne for ligne, avant_ligne in zip(actualise, lignes))
+
+            aapl = actualise[0]
+            assert aapl["prix_actuel"] == 200.0
+            assert aapl["valeur_actuelle"] == 2000.0  # 10 titres à 200€
+            assert aapl["pnl_montant"] == 500.0
+            assert aapl["pnl_pourcentage"] == pytest.approx(100 / 3)
+            print(f"OK AAPL actualisé : {aapl['prix_actuel']}€, PnL {aapl['pnl_montant']}€")
+
+            # Seuls les champs de prix changent
+            for ligne, ligne_avant in zip(actualise, avant):
+                assert ligne.keys() == ligne_avant.keys()
+                for champ in ligne.keys() - champs_prix:
+                    assert ligne[champ] == ligne_avant[champ], champ
+            assert any(
+                ligne[champ] != ligne_avant[champ]
+                for ligne, ligne_avant in zip(actualise, avant)
+                for champ in champs_prix
+            )
+
+            # Le résumé est identique à celui d'un recalcul complet
+            recalcul = self.price_service.calculate_investment_performance(investments, "bourse")
+            assert actualise == recalcul
+            assert self.price_service.calculate_portfolio_summary(
+                [], actualise
+            ) == self.price_service.calculate_portfolio_summary([], recalcul)
+            print("OK Résumé identique au recalcul complet")
+
+        print("SUCCESS Test actualisation des prix sur place réussi !")
+
+    def test_pnl_realise_fifo(self):
+        """Test du PnL réalisé FIFO : lot consommé en partie, vente sur plusieurs lots, survente"""
+        print("\n=== TEST PNL REALISE FIFO ===")
+
+        # Lot consommé en partie : 4 des 10 titres achetés à 100€ revendus à 150€
+        investissements = [
+            creer_donnees_investissement("2024-01-01", "AAPL", 1000.0, 100.0, False),
+            creer_donnees_vente("2024-02-01", "AAPL", 600.0, 150.0),
+        ]
+        resultat = self.price_service.calculate_realized_pnl(investissements, "AAPL")
+        assert resultat["pnl_realise_montant"] == 200.0  # 4 * (150 - 100)
+        assert resultat["quantite_vendue_totale"] == 4.0
+        assert resultat["prix_moyen_achat_vendu"] == 100.0
+        assert resultat["pnl_realise_pourcentage"] == 50.0
+        print(f"OK Lot partiel : {resultat['pnl_realise_montant']}€")
+
+        # Vente sur plusieurs lots (10@100 puis 5 des 10@200), puis vente du reste du
+        # second lot : la seconde vente reprend là où la première s'est arrêtée
+        investissements = [
+            creer_donnees_investissement("2024-01-01", "MSFT", 1000.0, 100.0, False),
+            creer_donnees_investissement("2024-02-01", "MSFT", 2000.0, 200.0, False),
+            creer_donnees_vente("2024-03-01", "MSFT", 3750.0, 250.0),
+            creer_donnees_vente("2024-04-01", "MSFT", 1500.0, 300.0),
+        ]
+        resultat = self.price_service.calculate_realized_pnl(investissements, "MSFT")
+        # (15 * 250 - (10 * 100 + 5 * 200)) + (5 * 300 - 5 * 200)
+        assert resultat["pnl_realise_montant"] == 2250.0
+        assert resultat["quantite_vendue_totale"] == 20.0
+        assert resultat["prix_moyen_achat_vendu"] == 150.0  # 3000€ de coût / 20
+        print(f"OK Vente sur plusieurs lots : {resultat['pnl_realise_montant']}€")
+
+        # Survente : 8 titres vendus pour 5 achetés, seuls les 5 achetés portent un PnL
+        investissements = [
+            creer_donnees_investissement("2024-01-01", "BTC", 500.0, 100.0, False),
+            creer_donnees_vente("2024-02-01", "BTC", 1200.0, 150.0),
+        ]
+        resultat = self.price_service.calculate_realized_pnl(investissements, "BTC")
+        assert resultat["pnl_realise_montant"] == 250.0  # 5 * (150 - 100)
+        assert resultat["quantite_vendue_totale"] == 8.0
+        assert resultat["prix_moyen_vente"] == 150.0
+        assert resultat["prix_moyen_achat_vendu"] == 62.5  # 500€ de coût / 8
+        print(f"OK Survente : {resultat['pnl_realise_montant']}€")
+
+        print("SUCCESS Test PnL réalisé FIFO réussi !")
+
+    def test_budget_disponible_sans_derive_flottante(self):
+        """Test du budget disponible : sommes exactes au centime, arrondies à l'euro supérieur"""
+        print("\n=== TEST BUDGET DISPONIBLE ===")
+
+        def revenu(bourse, crypto):
+            return {
+                "investissement_disponible_bourse": bourse,
+                "investissement_disponible_crypto": crypto,
+            }
+
+        # En flottants, 529.94 + 132.09 + 288.97 vaut 951.0000000000001 (même avec sum) :
+        # un arrondi supérieur sur la somme flottante donnerait 952€ au lieu de 951€
+        revenus = [revenu(529.94, 0.1), revenu(132.09, 0.2), revenu(288.97, 0.7)]
+        assert sum([529.94, 132.09, 288.97]) > 951
+
+        budget_bourse, budget_crypto, budget_total = calculer_budget_disponible(revenus)
+        assert budget_bourse == 951
+        assert budget_crypto == 1  # 0.1 + 0.2 + 0.7, exactement 1€
+        assert budget_total == 952
+
+        # Un reste au centime est bien arrondi à l'euro supérieur
+        assert calculer_budget_disponible([revenu(300.01, 0.0)]) == (301, 0, 301)
+        assert calculer_budget_disponible([]) == (0, 0, 0)
+        print(f"OK Budgets : {budget_bourse}€ bourse, {budget_crypto}€ crypto")
+
+        print("SUCCESS Test budget disponible réussi !")
+
+    def test_recuperation_prix_en_lot(self):
+        """Test de la récupération groupée des prix via les mappings appris"""
+        print("\n=== TEST PRIX EN LOT ===")
+
+        requete_mappings = self.mock_supabase.table.return_value.select.return_value.in_
+        requete_mappings.return_value.execute.return_value.data = [
+            {"user_symbol": "BTC", "yahoo_symbol": "BTC-EUR"},
+        ]
+        closes = pd.DataFrame({("Close", "BTC-EUR"): [44000.0, 45000.0]})
+
+        with (
+            patch("price_service.yf.download", return_value=closes) as mock_download,
+            patch.object(self.price_service, "get_current_price", self.mock_get_current_price),
+        ):
+            prices = self.price_service.fetch_prices_bulk(["BTC", "AAPL"], "crypto")
+
+        # BTC vient du téléchargement groupé, AAPL du repli symbole par symbole
+        assert mock_download.call_count == 1
+        assert prices == {"BTC": 45000.0, "AAPL": 150.0}
+        assert self.price_service.cache["crypto_BTC"]["price"] == 45000.0
+        print(f"OK Prix récupérés : {prices}")
+
+        # Un seul ticker, colonnes à un seul niveau (yfinance < 0.2.48) : "Close" est une
+        # Series, le prix doit quand même venir du téléchargement groupé
+        self.price_service.cache.clear()
+        closes_plates = pd.DataFrame({"Close": [44000.0, 46000.0], "Open": [43000.0, 45000.0]})
+
+        with (
+            patch("price_service.yf.download", return_value=closes_plates) as mock_download,
+            patch.object(self.price_service, "get_current_price") as mock_repli,
+        ):
+            prices = self.price_service.fetch_prices_bulk(["BTC"], "crypto")
+
+        assert mock_download.call_count == 1
+        mock_repli.assert_not_called()
+        assert prices == {"BTC": 46000.0}
+        print(f"OK Prix d'un seul ticker : {prices}")
+
+        print("SUCCESS Test prix en lot réussi !")
+
 
 def run_all_tests():
     """Lance tous les tests d'intégration"""
@@ -322,6 +559,11 @@ def run_all_tests():
         test_runner.test_scenario_multiple_achats_ventes,
         test_runner.test_validation_erreurs,
         test_runner.test_integration_performance_calculs,
+        test_runner.test_mise_a_jour_incrementale_resume,
+        test_runner.test_actualisation_prix_sur_place,
+        test_runner.test_pnl_realise_fifo,
+        test_runner.test_budget_disponible_sans_derive_flottante,
+        test_runner.test_recuperation_prix_en_lot,
     ]
 
     for i, test_func in enumerate(tests, 1):